@@ -44,6 +44,11 @@ def run_tests(app_tests, verbosity=1, interactive=False, base_dir=None):
 
     os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
 
+    import django
+    if hasattr(django, 'setup'):
+        # Django 1.7 or later requires to populate the app registry
+        django.setup()
+
     from django.conf import settings
     from django.test.utils import get_runner
     TestRunner = get_runner(settings)
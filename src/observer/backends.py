@@ -0,0 +1,515 @@
+# coding=utf-8
+"""
+Dispatch backends of django-observer
+
+A dispatch backend decides when and where the callbacks of watchers are
+called. Watchers call 'dispatch' method of the backend and the backend calls
+'invoke' method of the watcher to call the callback.
+"""
+__author__ = 'Alisue <lambdalisue@hashnote.net>'
+import time
+import logging
+import threading
+from functools import partial
+from django.db import connections
+from django.core.exceptions import ImproperlyConfigured
+from observer.conf import settings
+from observer.compat import import_module
+from observer.compat import on_commit
+from observer.compat import close_old_connections
+from observer.compat import has_commit_hooks
+from observer.compat import is_commit_hook_pending
+from observer.compat import OrderedDict
+from observer.compat import ThreadPoolExecutor
+from observer.compat import asyncio
+from observer.compat import iscoroutinefunction
+from observer.compat import get_running_loop
+
+
+logger = logging.getLogger(__name__)
+
+
+def merge_changes(previous, changes):
+    """
+    Merge two lists of `Change` records of the same object
+
+    The old value of the previous record and the new value of the latest
+    record are used. It returns None when any of them is None (unknown).
+
+    Args:
+        previous (None, list): A list of `Change` records
+        changes (None, list): A list of `Change` records
+
+    Returns:
+        None or list
+    """
+    if previous is None or changes is None:
+        return None
+    merged = list(previous)
+    indexes = dict((x.field, i) for i, x in enumerate(merged))
+    for change in changes:
+        if change.field in indexes:
+            i = indexes[change.field]
+            merged[i] = merged[i]._replace(new=change.new)
+        else:
+            indexes[change.field] = len(merged)
+            merged.append(change)
+    return merged
+
+
+def merge_diffs(previous, diff):
+    """
+    Merge two `RelationDiff` records of the same object
+
+    The diffs are applied in order thus a primary key added and removed later
+    is treated as removed. It returns None when any of them is None
+    (unknown).
+
+    Args:
+        previous (None, RelationDiff): A previous relation diff
+        diff (None, RelationDiff): A latest relation diff
+
+    Returns:
+        None or RelationDiff
+    """
+    if previous is None or diff is None:
+        return None
+    added = (previous.added - diff.removed) | diff.added
+    removed = (previous.removed - diff.added) | diff.removed
+    unchanged = (previous.unchanged | diff.unchanged) - added - removed
+    return diff._replace(added=added, removed=removed, unchanged=unchanged)
+
+
+class BaseBackend(object):
+    """
+    A base dispatch backend. Subclass must override `dispatch` method.
+    """
+    def dispatch(self, watcher, obj, changes=None, diff=None):
+        """
+        Dispatch a callback call of the watcher
+
+        Args:
+            watcher (watcher): A watcher which calls the callback
+            obj (obj): An object instance
+            changes (None, list): A list of `Change` records
+            diff (None, RelationDiff): A `RelationDiff` record
+        """
+        raise NotImplementedError
+
+    def dispatch_many(self, watcher, objs, changes=None, diff=None):
+        """
+        Dispatch a batch callback call of the watcher
+
+        Args:
+            watcher (watcher): A watcher which calls the callback
+            objs (list): A list of object instances
+            changes (None, list): A list of `Change` records
+            diff (None, RelationDiff): A `RelationDiff` record
+        """
+        raise NotImplementedError
+
+
+class ImmediateBackend(BaseBackend):
+    """
+    A dispatch backend which calls the callbacks immediately
+    """
+    def dispatch(self, watcher, obj, changes=None, diff=None):
+        watcher.invoke(obj, changes, diff)
+
+    def dispatch_many(self, watcher, objs, changes=None, diff=None):
+        watcher.invoke_many(objs, changes, diff)
+
+
+class OnCommitBackend(BaseBackend):
+    """
+    A dispatch backend which defers the callbacks until commit
+
+    The callbacks are queued and called when the current transaction is
+    committed. The queued calls are deduplicated by the watcher, the model
+    and the primary key of the object thus the callback is called only once
+    even the object is saved several times in a transaction. The batch calls
+    are merged per watcher thus the batch callback is called once with all
+    the objects affected in a transaction.
+    The queue is owned by a single commit hook of the transaction thus the
+    callbacks queued in a transaction which is rolled back are discarded
+    with the hook and never called (nor merged into the later
+    transactions). Notice that the callbacks queued after a savepoint which
+    is rolled back are not discarded while the transaction is committed.
+    It requires commit hooks (Django 1.9 or later, or
+    django-transaction-hooks) and `ImproperlyConfigured` is raised on
+    construction if they are not available on any of the databases.
+    """
+    def __init__(self):
+        for using in connections:
+            if not has_commit_hooks(using):
+                raise ImproperlyConfigured(
+                    'OnCommitBackend requires commit hooks but the database '
+                    '\'%s\' does not have them. Use Django 1.9 or later, '
+                    'or the database backends of django-transaction-hooks.'
+                    % using)
+        self._local = threading.local()
+
+    def get_pending(self, using=None):
+        """
+        Get a mapping of the queued calls of the current transaction of the
+        database and the commit hook which calls them
+
+        The hook is None until the first call is queued in the transaction.
+
+        Args:
+            using (None, str): A database alias
+
+        Returns:
+            A (pending, hook) tuple
+        """
+        if not hasattr(self._local, 'transactions'):
+            self._local.transactions = {}
+        entry = self._local.transactions.get(using)
+        if entry is None or not is_commit_hook_pending(entry[1],
+                                                       using=using):
+            # the hook has been called or discarded (rolled back) thus
+            # start a new queue for the next transaction
+            entry = (OrderedDict(), None)
+            self._local.transactions[using] = entry
+        return entry
+
+    def get_key(self, watcher, obj):
+        if not hasattr(obj, '_meta'):
+            # a primary key
+            return (watcher, obj.__class__, obj)
+        pk = obj.pk
+        return (watcher, obj.__class__, pk if pk is not None else id(obj))
+
+    def dispatch(self, watcher, obj, changes=None, diff=None):
+        using = self.get_using(obj)
+        pending, hook = self.get_pending(using)
+        key = self.get_key(watcher, obj)
+        if key in pending:
+            changes = merge_changes(pending[key][2], changes)
+            diff = merge_diffs(pending[key][3], diff)
+        pending[key] = (watcher, obj, changes, diff)
+        if hook is None:
+            self.register(pending, using)
+
+    def dispatch_many(self, watcher, objs, changes=None, diff=None):
+        if not objs:
+            return
+        using = self.get_using(objs[0])
+        pending, hook = self.get_pending(using)
+        # the batch calls are merged per relation diff because the objects
+        # of a batch share the diff
+        key = (watcher, None, diff)
+        if key in pending:
+            merged = pending[key][1]
+            changes = merge_changes(pending[key][2], changes)
+        else:
+            merged = OrderedDict()
+        for obj in objs:
+            merged[self.get_key(watcher, obj)] = obj
+        pending[key] = (watcher, merged, changes, diff)
+        if hook is None:
+            self.register(pending, using)
+
+    def register(self, pending, using=None):
+        """
+        Register a commit hook which calls the queued calls
+        """
+        hook = partial(self.flush, pending)
+        self._local.transactions[using] = (pending, hook)
+        # the hook is called immediately in autocommit mode
+        on_commit(hook, using=using)
+
+    def get_using(self, obj):
+        return getattr(getattr(obj, '_state', None), 'db', None)
+
+    def flush(self, pending):
+        """
+        Call the queued callbacks of a transaction
+        """
+        while pending:
+            key, entry = pending.popitem(last=False)
+            watcher, obj, changes, diff = entry
+            if key[1] is None:
+                # batch call
+                watcher.invoke_many(list(obj.values()), changes, diff)
+            else:
+                watcher.invoke(obj, changes, diff)
+
+
+class ThreadPoolBackend(BaseBackend):
+    """
+    A dispatch backend which calls the callbacks in worker threads
+
+    The callbacks are submitted to a bounded pool of worker threads thus the
+    saving thread does not wait the callbacks. The calls are partitioned by
+    the model and the primary key of the object and each partition is
+    handled by a single worker, so the callbacks of an object are called in
+    the order of the modifications. Exceptions raised in the callbacks are
+    logged and ignored.
+    It requires `concurrent.futures` ('futures' package in Python 2).
+    """
+    def __init__(self, max_workers=None):
+        """
+        Construct backend
+
+        Args:
+            max_workers (None, int): The number of worker threads.
+                `OBSERVER_DISPATCH_THREAD_POOL_SIZE` is used if it is not
+                specified
+        """
+        if ThreadPoolExecutor is None:
+            raise ImproperlyConfigured(
+                'ThreadPoolBackend requires concurrent.futures. '
+                'Install \'futures\' package in Python 2.')
+        if max_workers is None:
+            max_workers = settings.OBSERVER_DISPATCH_THREAD_POOL_SIZE
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executors = None
+        self._futures = {}
+        self._stats = dict(
+            submitted=0, started=0, completed=0, failed=0,
+            wait_time=0.0, callback_time=0.0,
+        )
+
+    @property
+    def executors(self):
+        """
+        A list of single worker executors (a worker per partition)
+        """
+        # executors are created lazily to prevent starting threads on import
+        if self._executors is None:
+            with self._lock:
+                if self._executors is None:
+                    self._executors = [ThreadPoolExecutor(max_workers=1)
+                                       for i in range(self.max_workers)]
+        return self._executors
+
+    def get_partition(self, obj):
+        pk = getattr(obj, 'pk', None)
+        key = (obj.__class__, pk if pk is not None else id(obj))
+        return hash(key) % self.max_workers
+
+    def dispatch(self, watcher, obj, changes=None, diff=None):
+        self._submit(self.get_partition(obj), watcher,
+                     partial(watcher.invoke, obj, changes, diff))
+
+    def dispatch_many(self, watcher, objs, changes=None, diff=None):
+        # the batch calls of a watcher are handled by a single worker
+        self._submit(hash(watcher) % self.max_workers, watcher,
+                     partial(watcher.invoke_many, objs, changes, diff))
+
+    def _submit(self, partition, watcher, fn):
+        executor = self.executors[partition]
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._futures[partition] = executor.submit(
+                self._run, watcher, fn, time.time())
+
+    def _run(self, watcher, fn, submitted_at):
+        started_at = time.time()
+        with self._lock:
+            self._stats['started'] += 1
+            self._stats['wait_time'] += started_at - submitted_at
+        failed = False
+        try:
+            fn()
+        except Exception:
+            failed = True
+            logger.exception('A callback of %r failed', watcher)
+        finally:
+            # the worker threads live longer than requests thus close the
+            # connections as the end of a request does
+            close_old_connections()
+        with self._lock:
+            self._stats['completed'] += 1
+            self._stats['failed'] += int(failed)
+            self._stats['callback_time'] += time.time() - started_at
+
+    def wait(self, timeout=None):
+        """
+        Wait until the callbacks submitted are called
+
+        Args:
+            timeout (None, int): The maximum number of seconds to wait per
+                partition
+        """
+        # each partition is handled by a single worker thus the last future
+        # of a partition completes after the others
+        for future in list(self._futures.values()):
+            future.exception(timeout=timeout)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads. They are started again on next dispatch
+        """
+        with self._lock:
+            executors, self._executors = self._executors, None
+        for executor in executors or ():
+            executor.shutdown(wait=wait)
+        self._futures = {}
+
+    def stats(self):
+        """
+        Return the statistics of the backend
+
+        Returns:
+            A dictionary which contains the number of the submitted, the
+            completed, the failed calls, the current queue depth and the
+            average seconds of the wait time and the callback time
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        started = stats.pop('started')
+        completed = stats['completed']
+        stats['queue_depth'] = stats['submitted'] - started
+        stats['wait_time'] = stats['wait_time'] / started if started else 0.0
+        stats['callback_time'] = (stats['callback_time'] / completed
+                                  if completed else 0.0)
+        return stats
+
+
+class AsyncioBackend(BaseBackend):
+    """
+    A dispatch backend which calls the callbacks in an asyncio event loop
+
+    The callbacks are scheduled on the event loop running in the current
+    thread or on a dedicated event loop thread when there is no running loop
+    thus the saving thread does not wait the callbacks. The calls dispatched
+    before the loop handles them are batched and run concurrently.
+    Coroutine function callbacks are run as tasks of the loop and the other
+    callbacks are run in the default executor of the loop. Exceptions raised
+    in the callbacks are logged and ignored.
+    It requires asyncio (Python 3.4 or later).
+    """
+    def __init__(self, loop=None):
+        """
+        Construct backend
+
+        Args:
+            loop (None, loop): An event loop used when there is no running
+                loop in the current thread. A loop running in a dedicated
+                thread is used if it is not specified
+        """
+        if asyncio is None:
+            raise ImproperlyConfigured(
+                'AsyncioBackend requires asyncio (Python 3.4 or later).')
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._pending = {}
+        self._unfinished = 0
+
+    @property
+    def loop(self):
+        """
+        An event loop used when there is no running loop
+        """
+        # the loop thread is started lazily to prevent starting threads on
+        # import
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=self._run_loop,
+                                              args=(loop,),
+                                              name='observer-asyncio')
+                    thread.daemon = True
+                    thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def _run_loop(self, loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def dispatch(self, watcher, obj, changes=None, diff=None):
+        self._schedule(watcher, partial(watcher.invoke, obj, changes, diff))
+
+    def dispatch_many(self, watcher, objs, changes=None, diff=None):
+        self._schedule(watcher,
+                       partial(watcher.invoke_many, objs, changes, diff))
+
+    def _schedule(self, watcher, fn):
+        running_loop = get_running_loop()
+        loop = running_loop or self.loop
+        with self._lock:
+            self._unfinished += 1
+            calls = self._pending.setdefault(loop, [])
+            calls.append((watcher, fn))
+            # only the first call of a batch schedules the flush
+            scheduled = len(calls) > 1
+        if scheduled:
+            return
+        if running_loop is not None:
+            loop.call_soon(self._flush, loop)
+        else:
+            loop.call_soon_threadsafe(self._flush, loop)
+
+    def _flush(self, loop):
+        with self._lock:
+            calls = self._pending.pop(loop, [])
+        for watcher, fn in calls:
+            if iscoroutinefunction(watcher.callback):
+                try:
+                    future = loop.create_task(fn())
+                except Exception:
+                    logger.exception('A callback of %r failed', watcher)
+                    self._done(None)
+                    continue
+            else:
+                future = loop.run_in_executor(None, fn)
+            future.add_done_callback(partial(self._done, watcher=watcher))
+
+    def _done(self, future, watcher=None):
+        if future is not None and not future.cancelled():
+            e = future.exception()
+            if e is not None:
+                logger.error('A callback of %r failed', watcher,
+                             exc_info=(type(e), e, e.__traceback__))
+        with self._condition:
+            self._unfinished -= 1
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the callbacks dispatched are called. It must not be called
+        in the thread of the event loop
+
+        Args:
+            timeout (None, int): The maximum number of seconds to wait
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._unfinished:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                self._condition.wait(remaining)
+
+
+_backends = {}
+
+
+def get_backend(backend=None):
+    """
+    Get a dispatch backend instance
+
+    Args:
+        backend (None, str, backend): A backend instance or a dotted path of
+            a backend class. `OBSERVER_DISPATCH_BACKEND` is used if it is not
+            specified
+
+    Returns:
+        backend
+    """
+    backend = backend or settings.OBSERVER_DISPATCH_BACKEND
+    if not isinstance(backend, basestring):
+        return backend
+    if backend not in _backends:
+        module_name, class_name = backend.rsplit('.', 1)
+        module = import_module(module_name)
+        _backends[backend] = getattr(module, class_name)()
+    return _backends[backend]
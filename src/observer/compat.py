@@ -6,14 +6,144 @@ except ImportError:
     from django.utils.importlib import import_module
 
 try:
-    from functools import lru_cahce
-except ImportError:
-    try:
-        # use pylru instead
-        from pylru import lrudecorator as lru_cache
-    except ImportError:
-        # use pylru is not installed
-        def lru_cache(maxsize):
-            def inner(fn):
-                return fn
-            return inner
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 does not have OrderedDict
+    from ordereddict import OrderedDict
+
+try:
+    from django.apps import apps
+except ImportError:
+    # Django < 1.7 does not have the app registry
+    from django.db.models.loading import get_model as _get_model
+
+    def get_model(app_label, model_name):
+        """
+        Return the model if it is already loaded, otherwise None
+        """
+        return _get_model(app_label, model_name, False)
+else:
+    def get_model(app_label, model_name):
+        """
+        Return the model if it is already loaded, otherwise None
+        """
+        try:
+            return apps.get_registered_model(app_label, model_name)
+        except LookupError:
+            return None
+
+try:
+    from django.db import close_old_connections
+except ImportError:
+    # Django < 1.6 does not have close_old_connections
+    from django.db import close_connection as close_old_connections
+
+try:
+    from django.db.transaction import on_commit
+except ImportError:
+    def on_commit(func, using=None):
+        """
+        Call the function when the current transaction is committed
+
+        Django < 1.9 does not have commit hooks. The hooks provided by
+        django-transaction-hooks are used if the database backend has them.
+
+        Raises:
+            ImproperlyConfigured: When commit hooks are not available
+        """
+        from django.db import connections, DEFAULT_DB_ALIAS
+        from django.core.exceptions import ImproperlyConfigured
+        connection = connections[using or DEFAULT_DB_ALIAS]
+        if not hasattr(connection, 'on_commit'):
+            raise ImproperlyConfigured(
+                'Commit hooks are not available. Use Django 1.9 or later, '
+                'or the database backends of django-transaction-hooks.')
+        connection.on_commit(func)
+
+
+def has_commit_hooks(using=None):
+    """
+    Return True if commit hooks are available on the database
+
+    Django 1.9 or later has commit hooks. Django < 1.9 has them only with the
+    database backends of django-transaction-hooks.
+    """
+    from django.db import connections, DEFAULT_DB_ALIAS
+    return hasattr(connections[using or DEFAULT_DB_ALIAS], 'on_commit')
+
+
+def is_in_transaction(using=None):
+    """
+    Return True if the database is in a transaction which can be rolled back
+    (an atomic block in Django 1.6 or later, a managed transaction in the
+    others) thus the modifications are not committed yet
+    """
+    from django.db import connections, transaction, DEFAULT_DB_ALIAS
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if hasattr(connection, 'in_atomic_block'):
+        return connection.in_atomic_block
+    return transaction.is_managed(using=using)
+
+
+def is_commit_hook_pending(func, using=None):
+    """
+    Return True if the function registered with 'on_commit' has been
+    neither called nor discarded (by a rollback) yet
+
+    Django does not provide a public API to inspect the registered hooks
+    thus this function reads the private `run_on_commit` list of the
+    connection (a list of (savepoint ids, func) tuples, plus `robust` in
+    Django 3.2 or later; the same list in django-transaction-hooks). It is
+    the only place which relies on the private attribute. If the attribute
+    is missing or has an unknown layout, the hook is reported as not
+    pending thus the callers register a new hook for each call instead of
+    merging the calls (correct, but not deduplicated).
+    """
+    from django.db import connections, DEFAULT_DB_ALIAS
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    hooks = getattr(connection, 'run_on_commit', None)
+    if not isinstance(hooks, (list, tuple)):
+        return False
+    for hook in hooks:
+        if isinstance(hook, tuple) and len(hook) > 1 and hook[1] is func:
+            return True
+    return False
+
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2 requires 'futures' (a backport of concurrent.futures)
+    ThreadPoolExecutor = None
+
+try:
+    import asyncio
+except ImportError:
+    # Python < 3.4 does not have asyncio
+    asyncio = None
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python < 3.7 does not have contextvars
+    ContextVar = None
+
+
+def iscoroutinefunction(fn):
+    """
+    Return if the function is a coroutine function of asyncio
+    """
+    if asyncio is None:
+        return False
+    return asyncio.iscoroutinefunction(fn)
+
+
+def get_running_loop():
+    """
+    Return the event loop running in the current thread or None
+    """
+    if asyncio is None:
+        return None
+    # Python < 3.5.3 does not provide a way to get the running loop
+    getter = getattr(asyncio, '_get_running_loop', None)
+    return getter() if getter else None
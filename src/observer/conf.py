@@ -10,4 +10,27 @@ from appconf import AppConf
 class ObserverAppConf(AppConf):
     DEFAULT_WATCHER = 'observer.watchers.ComplexWatcher'
 
-    LRU_CACHE_SIZE = 128
+    # capture snapshots of the watched models when the instances are loaded
+    # from the database instead of fetching them just before save
+    SNAPSHOT_ON_LOAD = False
+
+    # the maximum number of snapshots stored per model (None for unlimited)
+    SNAPSHOT_CACHE_SIZE = 1024
+
+    # the lifetime of the stored snapshots in seconds (None for unlimited)
+    SNAPSHOT_CACHE_TIMEOUT = None
+
+    # the default backend which calls the callbacks of watchers
+    DISPATCH_BACKEND = 'observer.backends.ImmediateBackend'
+
+    # the number of worker threads of ThreadPoolBackend
+    DISPATCH_THREAD_POOL_SIZE = 4
+
+    # the chunk size of the related objects which related watchers fetch
+    # (primary keys only) at once (None to fetch all objects at once)
+    FANOUT_CHUNK_SIZE = None
+
+    # the maximum number of primary keys which related watchers load at once
+    # when FANOUT_CHUNK_SIZE is not specified (e.g. pk_set of m2m_changed).
+    # notice that SQLite limits the number of variables in a query to 999
+    IN_BULK_CHUNK_SIZE = 500
@@ -0,0 +1,725 @@
+# coding=utf-8
+"""
+Model signal dispatchers of django-observer
+"""
+__author__ = 'Alisue <lambdalisue@hashnote.net>'
+import threading
+from contextlib import contextmanager
+from django.db.models.signals import pre_save
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.db.models.signals import post_delete
+from django.db.models.signals import m2m_changed
+from observer.conf import settings
+from observer.compat import OrderedDict
+from observer.compat import on_commit
+from observer.compat import has_commit_hooks
+from observer.compat import is_in_transaction
+from observer.investigator import Investigator
+from observer.suspension import get_suspended
+from observer.suspension import is_receiver_suspended
+from observer.utils.signals import register_reciever
+
+
+class Dispatcher(object):
+    """
+    A dispatcher of the signals of a model
+
+    A dispatcher connects a single receiver per signal to the model and
+    routes the signal to the watchers connected to the dispatcher. The
+    modifications of a saved instance are investigated once and only the
+    receivers of the modified fields are called, using a routing table of
+    field name and receivers.
+
+    The receivers connected with 'connect' are called with `instance`,
+    `changes` (a list of `Change` records of the fields interest) and
+    `snapshot` (an instance before save) when any of the fields is modified.
+    The receivers connected with 'connect_created' are called with
+    `instance` when a new instance is created and the receivers connected
+    with 'connect_m2m' are called with the arguments of `m2m_changed` signal.
+    The receivers connected with 'connect_deleted' are called with a list of
+    (deleted pk, affected pk) pairs captured before the instances are
+    deleted.
+    """
+    def __init__(self, model):
+        """
+        Construct dispatcher
+
+        Args:
+            model (model): A model class
+        """
+        self.model = model
+        # receiver -> (order, field names, required field names)
+        self._receivers = {}
+        # receiver -> a receiver of multiple instances
+        self._many_receivers = {}
+        self._many_created_receivers = {}
+        self._created_receivers = []
+        self._m2m_receivers = []
+        # receiver -> (capture, capture_many)
+        self._deleted_receivers = {}
+        self._index = {}
+        self._wildcards = []
+        self._order = 0
+        self._investigator = None
+        self._signals = set()
+
+    def connect(self, receiver, field_names=None, require=None, many=None):
+        """
+        Connect a receiver which is called when the fields are modified
+
+        Args:
+            receiver (fn): A function called with `instance`, `changes` and
+                `snapshot`
+            field_names (None, list, tuple): A field name list interest. All
+                fields if it is not specified
+            require (None, list, tuple): A field name list which is required
+                in snapshots
+            many (None, fn): A function called with a list of (`instance`,
+                `changes`, `snapshot`) when multiple instances are modified
+                at once (e.g. `QuerySet.update`). The receiver is called per
+                instance if it is not specified
+        """
+        if receiver in self._receivers:
+            return
+        if many is not None:
+            self._many_receivers[receiver] = many
+        self._order += 1
+        self._receivers[receiver] = (
+            self._order,
+            set(field_names) if field_names is not None else None,
+            set(require or ()),
+        )
+        self._compile()
+        self._connect_signal(pre_save, self._pre_save_receiver)
+        self._connect_signal(post_save, self._post_save_receiver)
+
+    def disconnect(self, receiver):
+        """
+        Disconnect a receiver connected with 'connect'
+        """
+        self._many_receivers.pop(receiver, None)
+        if self._receivers.pop(receiver, None) is not None:
+            self._compile()
+
+    def connect_created(self, receiver, many=None):
+        """
+        Connect a receiver which is called when a new instance is created
+
+        Args:
+            receiver (fn): A function called with `instance`
+            many (None, fn): A function called with a list of instances when
+                multiple instances are created at once (e.g.
+                `QuerySet.bulk_create`). The receiver is called per instance
+                if it is not specified
+        """
+        if receiver in self._created_receivers:
+            return
+        if many is not None:
+            self._many_created_receivers[receiver] = many
+        self._created_receivers.append(receiver)
+        self._connect_signal(post_save, self._post_save_receiver)
+
+    def disconnect_created(self, receiver):
+        """
+        Disconnect a receiver connected with 'connect_created'
+        """
+        self._many_created_receivers.pop(receiver, None)
+        if receiver in self._created_receivers:
+            self._created_receivers.remove(receiver)
+
+    def connect_m2m(self, receiver):
+        """
+        Connect a receiver of `m2m_changed` signal of the model (a through
+        model)
+
+        Args:
+            receiver (fn): A function called with the arguments of the signal
+        """
+        if receiver in self._m2m_receivers:
+            return
+        self._m2m_receivers.append(receiver)
+        self._connect_signal(m2m_changed, self._m2m_changed_receiver)
+
+    def disconnect_m2m(self, receiver):
+        """
+        Disconnect a receiver connected with 'connect_m2m'
+        """
+        if receiver in self._m2m_receivers:
+            self._m2m_receivers.remove(receiver)
+
+    def connect_deleted(self, receiver, capture, capture_many=None):
+        """
+        Connect a receiver which is called when instances are deleted
+
+        Args:
+            receiver (fn): A function called with a list of (deleted pk,
+                affected pk) pairs after the instances are deleted
+            capture (fn): A function called with an instance before it is
+                deleted. It must return a list of (deleted pk, affected pk)
+                pairs
+            capture_many (None, fn): A function called with a queryset before
+                the objects are deleted at once (`delete_collected`).
+                It must return a list of (deleted pk, affected pk) pairs with
+                a single query. 'capture' is called per object if it is not
+                specified
+        """
+        self._deleted_receivers[receiver] = (capture, capture_many)
+        self._connect_signal(pre_delete, self._pre_delete_receiver)
+        self._connect_signal(post_delete, self._post_delete_receiver)
+
+    def disconnect_deleted(self, receiver):
+        """
+        Disconnect a receiver connected with 'connect_deleted'
+        """
+        self._deleted_receivers.pop(receiver, None)
+
+    def capture_deleted(self, queryset):
+        """
+        Capture the pairs of the receivers connected with 'connect_deleted'
+        before the objects of the queryset are deleted at once
+
+        Args:
+            queryset (queryset): A queryset of the model
+
+        Returns:
+            A dictionary of the receiver and the pairs
+        """
+        captured = {}
+        for receiver, (capture, capture_many) in \
+                list(self._deleted_receivers.items()):
+            if capture_many is not None:
+                captured[receiver] = list(capture_many(queryset))
+            else:
+                captured[receiver] = [pair
+                                      for instance in queryset.iterator()
+                                      for pair in capture(instance)]
+        return captured
+
+    def capture_deleted_objects(self, instances, using=None):
+        """
+        Capture the pairs of the receivers connected with 'connect_deleted'
+        before the instances (e.g. collected by `Collector`) are deleted at
+        once
+
+        The pairs are captured with a single query per receiver (and per
+        `OBSERVER_IN_BULK_CHUNK_SIZE`) when the receiver is connected with
+        'capture_many'.
+
+        Args:
+            instances (iterable): Instances of the model
+            using (None, str): A database alias
+
+        Returns:
+            A dictionary of the receiver and the pairs
+        """
+        instances = list(instances)
+        if not instances:
+            return {}
+        manager = self.model._base_manager.db_manager(using)
+        pks = [x.pk for x in instances]
+        chunk_size = settings.OBSERVER_IN_BULK_CHUNK_SIZE or len(pks)
+        captured = {}
+        for receiver, (capture, capture_many) in \
+                list(self._deleted_receivers.items()):
+            if is_receiver_suspended(receiver):
+                continue
+            if capture_many is None:
+                captured[receiver] = [pair for instance in instances
+                                      for pair in capture(instance)]
+                continue
+            pairs = []
+            for i in range(0, len(pks), chunk_size):
+                queryset = manager.filter(pk__in=pks[i:i + chunk_size])
+                pairs.extend(capture_many(queryset))
+            captured[receiver] = pairs
+        return captured
+
+    def dispatch_deleted(self, captured):
+        """
+        Call the receivers connected with 'connect_deleted' with the captured
+        pairs. The call is deferred until the end of 'collect_deleted' if
+        it is active
+
+        Args:
+            captured (dict): A dictionary of the receiver and the pairs
+        """
+        buffer = getattr(_local, 'deleted', None)
+        for receiver, pairs in captured.items():
+            if not pairs:
+                continue
+            if buffer is not None:
+                buffer.setdefault(receiver, []).extend(pairs)
+            else:
+                receiver(pairs)
+
+    def is_suspended(self):
+        """
+        Return True if the watchers of all receivers connected with
+        'connect' are suspended thus snapshots are not required
+        """
+        if not get_suspended():
+            return False
+        for receiver in list(self._receivers):
+            if not is_receiver_suspended(receiver):
+                return False
+        return True
+
+    def _pre_delete_receiver(self, sender, instance, **kwargs):
+        if self.model in getattr(_local, 'captured_models', ()):
+            # captured at once by 'capture_deleted'
+            return
+        pending = _get_pending_deleted()
+        for receiver, (capture, capture_many) in \
+                list(self._deleted_receivers.items()):
+            if is_receiver_suspended(receiver):
+                continue
+            pending[(receiver, self.model, instance.pk)] = capture(instance)
+
+    def _post_delete_receiver(self, sender, instance, **kwargs):
+        pending = _get_pending_deleted()
+        captured = {}
+        for receiver in list(self._deleted_receivers):
+            pairs = pending.pop((receiver, self.model, instance.pk), None)
+            if pairs:
+                captured[receiver] = pairs
+        self.dispatch_deleted(captured)
+
+    def _connect_signal(self, signal, receiver):
+        # the receivers of the dispatcher are connected only once and never
+        # disconnected. watchers are connected to (or disconnected from) the
+        # dispatcher instead
+        if signal in self._signals:
+            return
+        register_reciever(self.model, signal, receiver)
+        self._signals.add(signal)
+
+    def _compile(self):
+        # build the routing table and the investigator of the union of the
+        # fields interest
+        index = {}
+        wildcards = []
+        include = set()
+        require = set()
+        receivers = sorted(self._receivers.items(), key=lambda x: x[1][0])
+        for receiver, (order, field_names, required) in receivers:
+            require.update(required)
+            if field_names is None:
+                wildcards.append(receiver)
+                include = None
+                continue
+            if include is not None:
+                include.update(field_names)
+            for field_name in field_names:
+                index.setdefault(field_name, []).append(receiver)
+        self._index = index
+        self._wildcards = wildcards
+        if not self._receivers or include == set():
+            self._investigator = None
+            return
+        self._investigator = Investigator(self.model,
+                                          include=include,
+                                          require=require)
+
+    def route(self, changes):
+        """
+        Find receivers of the changes
+
+        Args:
+            changes (list): A list of `Change` records
+
+        Returns:
+            A list of (receiver, changes) ordered by the connection
+        """
+        routes = {}
+        for change in changes:
+            for receiver in self._index.get(change.field, ()):
+                routes.setdefault(receiver, []).append(change)
+        for receiver in self._wildcards:
+            routes[receiver] = changes
+        if get_suspended():
+            # the suspended receivers might query the related objects
+            for receiver in list(routes):
+                if is_receiver_suspended(receiver):
+                    del routes[receiver]
+        return sorted(routes.items(),
+                      key=lambda x: self._receivers[x[0]][0])
+
+    @property
+    def investigator(self):
+        """
+        An investigator of the fields interest or None if no receiver is
+        connected
+        """
+        return self._investigator
+
+    def capture(self, queryset):
+        """
+        Capture snapshots of the objects of the queryset with a single query
+        before the objects are modified at once (e.g. `QuerySet.update`)
+
+        Args:
+            queryset (queryset): A queryset of the model
+
+        Returns:
+            A dictionary of the primary key and the snapshot
+        """
+        investigator = self._investigator
+        if investigator is None:
+            return {}
+        return investigator.get_objects(queryset)
+
+    def dispatch_updated(self, snapshots, using=None):
+        """
+        Investigate the objects captured with 'capture' after they are
+        modified at once and call the receivers of the modifications
+
+        The latest objects are loaded with `in_bulk` in chunks of
+        `OBSERVER_IN_BULK_CHUNK_SIZE`.
+
+        Args:
+            snapshots (dict): A dictionary 'capture' returns
+            using (None, str): A database alias
+        """
+        investigator = self._investigator
+        if investigator is None or not snapshots:
+            return
+        manager = self.model._default_manager.db_manager(using)
+        plan = investigator.plan
+        pks = list(snapshots)
+        chunk_size = settings.OBSERVER_IN_BULK_CHUNK_SIZE or len(pks)
+        entries = []
+        for i in range(0, len(pks), chunk_size):
+            chunk = pks[i:i + chunk_size]
+            instances = manager.in_bulk(chunk)
+            for pk in chunk:
+                if pk not in instances:
+                    continue
+                changes = list(plan.changes(snapshots[pk], instances[pk]))
+                if changes:
+                    entries.append((instances[pk], changes, snapshots[pk]))
+        self.dispatch_many(entries)
+
+    def prefetch(self, pks):
+        """
+        Capture snapshots of the objects of the primary keys with a single
+        query per `OBSERVER_IN_BULK_CHUNK_SIZE` before they are saved
+
+        Args:
+            pks (list): A list of primary keys
+
+        Returns:
+            A dictionary of the primary key and the snapshot
+        """
+        pks = list(pks)
+        if self._investigator is None or not pks:
+            return {}
+        manager = self.model._default_manager
+        chunk_size = settings.OBSERVER_IN_BULK_CHUNK_SIZE or len(pks)
+        snapshots = {}
+        for i in range(0, len(pks), chunk_size):
+            snapshots.update(self.capture(
+                manager.filter(pk__in=pks[i:i + chunk_size])))
+        return snapshots
+
+    def dispatch_saved(self, saved):
+        """
+        Investigate the instances saved in 'bulk' and call the receivers of
+        the modifications at once
+
+        Args:
+            saved (dict): A dictionary of the primary key and a list of
+                (`instance`, `snapshot`, `update_fields`) where the
+                `instance` is the latest saved instance and the `snapshot`
+                is the snapshot before the first save
+        """
+        investigator = self._investigator
+        if investigator is None:
+            return
+        entries = []
+        for instance, snapshot, update_fields in saved.values():
+            if snapshot is None:
+                continue
+            plan = investigator.get_plan(update_fields)
+            changes = list(plan.changes(snapshot, instance))
+            if changes:
+                entries.append((instance, changes, snapshot))
+        self.dispatch_many(entries)
+
+    def dispatch_many(self, entries):
+        """
+        Call the receivers of the modifications of multiple instances
+
+        Args:
+            entries (list): A list of (`instance`, `changes`, `snapshot`)
+        """
+        routes = {}
+        for instance, changes, snapshot in entries:
+            for receiver, routed in self.route(changes):
+                routes.setdefault(receiver, []).append(
+                    (instance, routed, snapshot))
+        for receiver in sorted(routes, key=lambda x: self._receivers[x][0]):
+            many = self._many_receivers.get(receiver)
+            if many is not None:
+                many(routes[receiver])
+                continue
+            for instance, routed, snapshot in routes[receiver]:
+                receiver(instance, routed, snapshot)
+
+    def dispatch_created(self, instances):
+        """
+        Call the receivers connected with 'connect_created' for multiple
+        instances created at once
+
+        Args:
+            instances (list): A list of the created instances
+        """
+        if not instances:
+            return
+        for receiver in list(self._created_receivers):
+            many = self._many_created_receivers.get(receiver)
+            if many is not None:
+                many(instances)
+                continue
+            for instance in instances:
+                receiver(instance)
+
+    def _pre_save_receiver(self, sender, instance, **kwargs):
+        if kwargs.get('raw', False):
+            # should not call any callback while it is called via fixtures or
+            # so on
+            return
+        investigator = self._investigator
+        if investigator is None or self.is_suspended():
+            return
+        state = getattr(_local, 'bulk', None)
+        if state is not None:
+            self._collect_saved(state, instance,
+                                kwargs.get('update_fields', None))
+            return
+        investigator.prepare(instance, kwargs.get('update_fields', None))
+
+    def _collect_saved(self, state, instance, update_fields):
+        pk = instance.pk
+        if pk is None:
+            # newly created
+            return
+        if update_fields is not None:
+            update_fields = frozenset(update_fields)
+        saved = state['saved'].setdefault(self.model, OrderedDict())
+        if pk in saved:
+            # keep the snapshot before the first save
+            entry = saved[pk]
+            entry[0] = instance
+            if entry[2] is not None:
+                entry[2] = (None if update_fields is None
+                            else entry[2] | update_fields)
+            return
+        prefetched = state['prefetched'].get(self.model, {})
+        snapshot = prefetched.pop(pk, None)
+        if snapshot is None:
+            investigator = self._investigator
+            snapshot = investigator.registry.get_loaded(self.model, instance)
+            if snapshot is None:
+                snapshot = investigator.get_object(pk)
+        saved[pk] = [instance, snapshot, update_fields]
+
+    def _post_save_receiver(self, sender, instance, created, **kwargs):
+        if kwargs.get('raw', False):
+            # should not call any callback while it is called via fixtures or
+            # so on
+            return
+        state = getattr(_local, 'bulk', None)
+        if state is not None:
+            # investigated and dispatched at the end of 'bulk'
+            state['done'].add((self.model, instance.pk))
+            if created and self._created_receivers:
+                state['created'].setdefault(self.model, []).append(instance)
+            return
+        if created:
+            for receiver in list(self._created_receivers):
+                receiver(instance)
+        investigator = self._investigator
+        if investigator is None:
+            return
+        update_fields = kwargs.get('update_fields', None)
+        snapshot = investigator.registry.get_prepared(self.model, instance)
+        changes = investigator.investigate_changes(instance, update_fields)
+        if not changes:
+            return
+        for receiver, routed in self.route(changes):
+            receiver(instance, routed, snapshot)
+
+    def _m2m_changed_receiver(self, sender, **kwargs):
+        for receiver in list(self._m2m_receivers):
+            receiver(sender=sender, **kwargs)
+
+
+_dispatchers = {}
+_local = threading.local()
+
+
+def _get_pending_deleted():
+    if not hasattr(_local, 'pending_deleted'):
+        _local.pending_deleted = {}
+    return _local.pending_deleted
+
+
+@contextmanager
+def collect_deleted(captured_models=()):
+    """
+    A context manager which collects the deletions in the context and calls
+    the receivers connected with 'connect_deleted' once per receiver at the
+    end of the context (e.g. the cascaded deletions). The collected
+    deletions are discarded if an exception is raised in the context
+
+    Args:
+        captured_models (list, tuple): Models which deleted objects are
+            captured at once by 'capture_deleted' thus they are not captured
+            per object
+    """
+    outermost = getattr(_local, 'deleted', None) is None
+    previous_models = getattr(_local, 'captured_models', frozenset())
+    if outermost:
+        _local.deleted = {}
+    _local.captured_models = previous_models | frozenset(captured_models)
+    try:
+        yield
+    except Exception:
+        if outermost:
+            _local.deleted = None
+        raise
+    finally:
+        _local.captured_models = previous_models
+    if outermost:
+        buffer, _local.deleted = _local.deleted, None
+        for receiver, pairs in buffer.items():
+            receiver(pairs)
+
+
+def delete_collected(collector):
+    """
+    Delete the objects collected by a `Collector` and call the receivers
+    connected with 'connect_deleted' once per receiver
+
+    The collected objects, including the cascaded ones, are captured at once
+    per model before the deletion instead of per object on `pre_delete`.
+
+    Args:
+        collector (Collector): A collector which has collected the objects
+
+    Returns:
+        The value `Collector.delete` returns
+    """
+    models = [x for x in collector.data if x in _dispatchers]
+    with collect_deleted(captured_models=models):
+        captured = []
+        for model in models:
+            dispatcher = _dispatchers[model]
+            captured.append((dispatcher, dispatcher.capture_deleted_objects(
+                collector.data[model], using=collector.using)))
+        result = collector.delete()
+        for dispatcher, pairs in captured:
+            dispatcher.dispatch_deleted(pairs)
+    return result
+
+
+@contextmanager
+def bulk(objs=None):
+    """
+    A context manager which collects the instances saved in the context and
+    calls the receivers once per model at the end of the context
+
+    The modifications are investigated once per instance between the
+    snapshot before the first save and the latest instance, thus the
+    receivers are called once per instance even if it is saved several times.
+    The snapshots of `objs` are fetched with a single query per model (and
+    per `OBSERVER_IN_BULK_CHUNK_SIZE`) on enter. Notice that the snapshots
+    of the other instances are still fetched on save unless they are
+    captured on load (`OBSERVER_SNAPSHOT_ON_LOAD`).
+    If an exception is raised in the context, the instances saved before
+    the exception are dispatched as well when they are committed: at once in
+    autocommit, or when the enclosing atomic block is committed if commit
+    hooks are available (they are discarded if the block is rolled back).
+    They are discarded if they are saved in a transaction without commit
+    hooks because it cannot be told whether the saves are rolled back.
+
+    Args:
+        objs (None, iterable): Model instances which are going to be saved
+            in the context
+
+    Example:
+        >>> with bulk(articles):
+        ...     for article in articles:
+        ...         article.title = 'modified'
+        ...         article.save()
+    """
+    outermost = getattr(_local, 'bulk', None) is None
+    if outermost:
+        _local.bulk = dict(saved=OrderedDict(),
+                           created=OrderedDict(),
+                           prefetched={},
+                           done=set())
+    state = _local.bulk
+    completed = False
+    try:
+        pks = OrderedDict()
+        for obj in objs or ():
+            if obj.pk is not None:
+                pks.setdefault(obj.__class__, []).append(obj.pk)
+        for model, model_pks in pks.items():
+            snapshots = get_dispatcher(model).prefetch(model_pks)
+            state['prefetched'].setdefault(model, {}).update(snapshots)
+        yield
+        completed = True
+    finally:
+        if outermost:
+            _local.bulk = None
+            if not completed:
+                # the original exception is raised after the dispatch
+                _dispatch_bulk_on_commit(state)
+    if outermost:
+        _dispatch_bulk(state)
+
+
+def _dispatch_bulk(state):
+    for model, instances in state['created'].items():
+        get_dispatcher(model).dispatch_created(instances)
+    for model, saved in state['saved'].items():
+        # the instances which failed to be saved are not dispatched
+        saved = OrderedDict((pk, entry) for pk, entry in saved.items()
+                            if (model, pk) in state['done'])
+        get_dispatcher(model).dispatch_saved(saved)
+
+
+def _dispatch_bulk_on_commit(state):
+    # dispatch the instances saved in 'bulk' before an exception is raised
+    # once the saves are committed
+    usings = set()
+    for instances in state['created'].values():
+        usings.update(x._state.db for x in instances)
+    for model, saved in state['saved'].items():
+        usings.update(entry[0]._state.db for pk, entry in saved.items()
+                      if (model, pk) in state['done'])
+    atomic = [x for x in usings if is_in_transaction(x)]
+    if not atomic:
+        # autocommit, the saves have been committed already
+        _dispatch_bulk(state)
+    elif len(atomic) == 1 and has_commit_hooks(atomic[0]):
+        # the hook is discarded if the atomic block is rolled back
+        on_commit(lambda: _dispatch_bulk(state), using=atomic[0])
+
+
+def get_dispatcher(model):
+    """
+    Get a dispatcher of the model
+
+    Args:
+        model (model): A model class
+
+    Returns:
+        Dispatcher
+    """
+    if model not in _dispatchers:
+        _dispatchers[model] = Dispatcher(model)
+    return _dispatchers[model]
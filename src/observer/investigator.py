@@ -1,4 +1,125 @@
+from operator import ne
+from operator import attrgetter
+from collections import namedtuple
 from django.core.exceptions import ObjectDoesNotExist
+from observer.conf import settings
+from observer.compat import OrderedDict
+from observer.snapshots import build_snapshot
+from observer.snapshots import registry as default_registry
+
+
+class Change(namedtuple('Change', ('field', 'old', 'new'))):
+    """
+    A modification of a field: the field name and the old and new values.
+    The values of relational fields are raw column values (e.g. `author_id`)
+    unless `compare_related` is specified to the investigator.
+    """
+    __slots__ = ()
+
+
+class RelationDiff(namedtuple('RelationDiff',
+                              ('added', 'removed', 'unchanged'))):
+    """
+    A modification of a relation: frozensets of the primary keys of the
+    related objects which are added to, removed from, or unchanged in the
+    relation
+    """
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, added=(), removed=(), unchanged=()):
+        """
+        Create a relation diff from iterables of primary keys
+        """
+        return cls(frozenset(added), frozenset(removed), frozenset(unchanged))
+
+    @classmethod
+    def from_pks(cls, old, new):
+        """
+        Create a relation diff from the old and new primary key sets
+        """
+        old = frozenset(old)
+        new = frozenset(new)
+        return cls(new - old, old - new, old & new)
+
+
+def get_field_names(model, include=None, exclude=None):
+    """
+    Get a set of field names of the model filtered by include and exclude
+
+    Args:
+        model (model): A model class
+        include (None, list, tuple): A field name list which will be included
+        exclude (None, list, tuple): A field name list which will be excluded
+
+    Returns:
+        set
+    """
+    field_names = set(x.name for x in model._meta.fields)
+    if include:
+        field_names.intersection_update(include)
+    if exclude:
+        field_names.difference_update(exclude)
+    return field_names
+
+
+class DiffPlan(object):
+    """
+    A precompiled plan to find modified fields of a model instance
+
+    The attribute names are fixed on construction thus finding modifications
+    costs one tuple extraction for each instance and one tuple comparison.
+    The values are compared field by field only when the tuples differ.
+    """
+    def __init__(self, names, attnames, comparators=None):
+        """
+        Construct diff plan
+
+        Args:
+            names (list, tuple): A field name list which will be yielded
+            attnames (list, tuple): An attribute name list which will be
+                compared. It must have the same order as `names`
+            comparators (None, dict): A mapping of field name and a function
+                which is called with the old and new values and return True
+                when the value is modified. Notice that equal values are
+                never treated as modified
+        """
+        comparators = comparators or {}
+        self.names = tuple(names)
+        self.attnames = tuple(attnames)
+        self.comparators = tuple(comparators.get(x, ne) for x in self.names)
+        if len(self.attnames) == 1:
+            getter = attrgetter(self.attnames[0])
+            self.extract = lambda obj: (getter(obj),)
+        elif self.attnames:
+            self.extract = attrgetter(*self.attnames)
+        else:
+            self.extract = lambda obj: ()
+
+    def diff(self, old, new):
+        """
+        Yield names of modified fields between the old and new instances
+        """
+        for change in self.changes(old, new):
+            yield change.field
+
+    def changes(self, old, new):
+        """
+        Yield `Change` records of modified fields between the old and new
+        instances
+        """
+        try:
+            old_values = self.extract(old)
+        except AttributeError:
+            # the snapshot does not have some of the attributes
+            old_values = tuple(getattr(old, x, None) for x in self.attnames)
+        new_values = self.extract(new)
+        if old_values == new_values:
+            return
+        for name, comparator, old_value, new_value in zip(
+                self.names, self.comparators, old_values, new_values):
+            if old_value != new_value and comparator(old_value, new_value):
+                yield Change(name, old_value, new_value)
 
 
 class Investigator(object):
@@ -8,8 +129,15 @@ class Investigator(object):
     Create an instance of investigator with a model class and call 'prepare'
     method just before save the model. After the model is saved, call
     'investigate' method and the method will yields the field names modified.
+
+    The snapshots are stored in a snapshot registry shared with the other
+    investigators of the same model thus the row is fetched only once per save.
+    With `snapshot_on_load`, the snapshots are captured when the instances are
+    loaded and no query is executed in 'prepare' for the loaded instances.
     """
-    def __init__(self, model, include=None, exclude=None):
+    def __init__(self, model, include=None, exclude=None, registry=None,
+                 snapshot_on_load=None, require=None, compare_related=False,
+                 comparators=None):
         """
         Construct investigator
 
@@ -19,42 +147,151 @@ class Investigator(object):
                 investigated
             exclude (None, list, tuple): A field name list which wont't be
                 investigated
+            registry (None, SnapshotRegistry): A snapshot registry. The
+                process-wide registry is used if it is not specified
+            snapshot_on_load (None, bool): Capture snapshots when the
+                instances are loaded. `OBSERVER_SNAPSHOT_ON_LOAD` is used if it
+                is not specified
+            require (None, list, tuple): A field name list which will be
+                fetched in snapshots but won't be investigated
+            compare_related (bool): Compare the related objects of relational
+                fields instead of the raw column values (e.g. `author_id`).
+                Notice that it may execute queries to find related objects
+            comparators (None, dict): A mapping of field name and a function
+                which is called with the old and new values and return True
+                when the value is modified
         """
         self.model = model
-        self.include = set(include) if include is not None else None
-        self.exclude = set(exclude) if exclude is not None else None
-        self._object_cached = {}
+        self.include = include
+        self.exclude = exclude
+        self.compare_related = compare_related
+        self.comparators = comparators
+        self.registry = registry or default_registry
+        self._object_cached = self.registry.get_store(model)
+        # fetch only the investigated (and required) columns in snapshots
+        field_names = None
+        if self.include or self.exclude:
+            field_names = self.get_field_names() | set(require or ())
+        self.registry.register_fields(model, field_names)
+        if snapshot_on_load is None:
+            snapshot_on_load = settings.OBSERVER_SNAPSHOT_ON_LOAD
+        if snapshot_on_load:
+            self.registry.capture_on_load(model)
+
+    @property
+    def include(self):
+        return self._include
 
-    def prepare(self, instance):
+    @include.setter
+    def include(self, value):
+        self._include = set(value) if value is not None else None
+        self._plans = {}
+
+    @property
+    def exclude(self):
+        return self._exclude
+
+    @exclude.setter
+    def exclude(self, value):
+        self._exclude = set(value) if value is not None else None
+        self._plans = {}
+
+    @property
+    def plan(self):
+        """
+        A diff plan compiled from the investigated fields
+        """
+        return self.get_plan()
+
+    def get_plan(self, update_fields=None):
+        """
+        Get a diff plan of the investigated fields which can be modified by
+        a save with the `update_fields`
+
+        Args:
+            update_fields (None, list, tuple): A field name list passed to
+                `save` method. All investigated fields if it is None
+
+        Returns:
+            DiffPlan
+        """
+        key = frozenset(update_fields) if update_fields is not None else None
+        if key not in self._plans:
+            fields = self.get_fields()
+            if key is not None:
+                fields = [x for x in fields
+                          if x.name in key or x.attname in key]
+            if self.compare_related:
+                attnames = [x.name for x in fields]
+            else:
+                # the raw column values (attname) are compared to prevent
+                # queries for the related objects
+                attnames = [x.attname for x in fields]
+            self._plans[key] = DiffPlan([x.name for x in fields], attnames,
+                                        self.comparators)
+        return self._plans[key]
+
+    def is_affected(self, update_fields=None):
+        """
+        Return True if a save with the `update_fields` can modify any of the
+        investigated fields
+        """
+        if update_fields is None:
+            return True
+        return bool(self.get_plan(update_fields).names)
+
+    def prepare(self, instance, update_fields=None):
         """
         Call this function before save the model instance
+
+        Nothing is fetched when the `update_fields` does not contain any of
+        the investigated fields.
         """
         if instance.pk is None:
             return
-        # find raw instance from the database
-        raw_instance = self.get_object(instance.pk)
-        # update object cache
-        self._object_cached[instance.pk] = raw_instance
+        if not self.is_affected(update_fields):
+            return
+        # find raw instance from the database (or share the one fetched by
+        # the other investigators for this save)
+        self.registry.prepare(self.model, instance, self.get_object)
 
-    def investigate(self, instance):
+    def investigate(self, instance, update_fields=None):
         """
         Call this function after the model instance is saved.
         It yield a name of modified attributes
         """
-        cached_obj = self.get_cached(instance.pk)
+        for change in self.investigate_changes(instance, update_fields):
+            yield change.field
+
+    def investigate_changes(self, instance, update_fields=None):
+        """
+        Call this function after the model instance is saved.
+        It return a list of `Change` records of modified attributes
+
+        The `update_fields` must be the same as the one passed to 'prepare'
+        and only the fields in the `update_fields` are investigated.
+        """
+        if not self.is_affected(update_fields):
+            return []
+        cached_obj = self.registry.consume(self.model, instance)
         if cached_obj is None:
-            return
-        field_names = set(x.name for x in self.model._meta.fields)
-        if self.include:
-            field_names.intersection_update(self.include)
-        if self.exclude:
-            field_names.difference_update(self.exclude)
+            return []
         # compare field difference
-        for field_name in field_names:
-            old = getattr(cached_obj, field_name, None)
-            new = getattr(instance, field_name, None)
-            if old != new:
-                yield field_name
+        plan = self.get_plan(update_fields)
+        return list(plan.changes(cached_obj, instance))
+
+    def get_field_names(self):
+        """
+        Get a set of field names which will be investigated
+        """
+        return get_field_names(self.model, self.include, self.exclude)
+
+    def get_fields(self):
+        """
+        Get a list of fields which will be investigated
+        """
+        field_names = self.get_field_names()
+        return [x for x in self.model._meta.fields if x.name in field_names]
 
     def get_cached(self, pk, ignore_exception=True):
         """
@@ -84,6 +321,10 @@ class Investigator(object):
         If `ignore_exception` is True, return None, otherwise it raise
         ObjectDoesNotExist exception when no object is found.
 
+        Only the columns required by the investigators of the model are
+        fetched and the object is a detached instance which only has the
+        values of these columns.
+
         Args:
             pk (any): A primary key of the object
             ignore_exception (bool): Return None if the object is not found.
@@ -98,11 +339,38 @@ class Investigator(object):
         """
 
         default_manager = self.model._default_manager
-        # try to find the latest (unsaved) object from the database
+        fields = self.registry.get_fields(self.model)
+        # try to find the latest (unsaved) values from the database
         try:
-            latest_obj = default_manager.get(pk=pk)
-            return latest_obj
+            queryset = default_manager.filter(pk=pk)
+            values = queryset.values_list(*[x.name for x in fields]).get()
+            return build_snapshot(self.model,
+                                  dict(zip([x.attname for x in fields],
+                                           values)),
+                                  db=queryset.db)
         except ObjectDoesNotExist:
             if ignore_exception:
                 return None
             raise
+
+    def get_objects(self, queryset):
+        """
+        Get latest objects of the queryset with a single query
+
+        The objects are detached instances like the one `get_object`
+        returns.
+
+        Args:
+            queryset (queryset): A queryset of the model
+
+        Returns:
+            An ordered dictionary of the primary key and the object
+        """
+        fields = self.registry.get_fields(self.model)
+        attnames = [x.attname for x in fields]
+        index = [x.primary_key for x in fields].index(True)
+        objects = OrderedDict()
+        for values in queryset.values_list(*[x.name for x in fields]):
+            objects[values[index]] = build_snapshot(
+                self.model, dict(zip(attnames, values)), db=queryset.db)
+        return objects
@@ -0,0 +1,128 @@
+# coding=utf-8
+"""
+Observer aware QuerySet, Manager and model mixin of django-observer
+
+`QuerySet.update` does not send `pre_save` and `post_save` signals thus the
+watchers are not notified. Use `ObserverManager` (or `ObserverQuerySetMixin`)
+to notify the watchers of the modifications made by `QuerySet.update`.
+Use `ObserverModelMixin` to notify the watchers of the deletions made by
+`Model.delete` (including the cascaded deletions) at once.
+"""
+__author__ = 'Alisue <lambdalisue@hashnote.net>'
+from django.db import models
+from django.db import router
+from django.db.models.query import QuerySet
+from django.db.models.deletion import Collector
+from observer.dispatcher import get_dispatcher
+from observer.dispatcher import delete_collected
+
+
+class ObserverQuerySetMixin(object):
+    """
+    A QuerySet mixin which notifies the watchers of `update`,
+    `bulk_create`, `delete` (and `bulk_update` in Django 2.2 or later)
+
+    The watched columns of the affected rows are captured with a single
+    query before the update and the latest rows are loaded with `in_bulk`
+    after the update. The modifications are investigated in bulk and the
+    batch callbacks are called once per update.
+    The created objects of `bulk_create` are passed to the creation
+    callbacks at once (the batch callbacks are called once per
+    `bulk_create`) without signals or queries. Notice that the objects do not
+    have primary keys unless the database backend returns them.
+    The objects deleted by `delete`, including the cascaded ones, are
+    captured with a single query per model and watcher before the deletion
+    and the callbacks are called once per watcher after the deletion.
+    Notice that the rows modified by the others between the capture and the
+    update are not detected unless the update is executed in a transaction.
+    """
+    def update(self, **kwargs):
+        dispatcher = get_dispatcher(self.model)
+        if dispatcher.investigator is None or dispatcher.is_suspended():
+            # nothing is watched or all watchers are suspended
+            return super(ObserverQuerySetMixin, self).update(**kwargs)
+        snapshots = dispatcher.capture(self)
+        rows = super(ObserverQuerySetMixin, self).update(**kwargs)
+        dispatcher.dispatch_updated(snapshots, using=self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super(ObserverQuerySetMixin, self).bulk_create(objs,
+                                                              *args,
+                                                              **kwargs)
+        get_dispatcher(self.model).dispatch_created(objs)
+        return objs
+
+    def delete(self):
+        # the same as QuerySet.delete except that the collected objects are
+        # captured before the deletion
+        assert self.query.can_filter(), \
+            "Cannot use 'limit' or 'offset' with delete."
+        del_query = self._clone()
+        del_query._for_write = True
+        # disable non-supported fields
+        del_query.query.select_for_update = False
+        del_query.query.select_related = False
+        del_query.query.clear_ordering(force_empty=True)
+        collector = Collector(using=del_query.db)
+        collector.collect(del_query)
+        result = delete_collected(collector)
+        # clear the result cache, in case this QuerySet gets reused
+        self._result_cache = None
+        return result
+    delete.alters_data = True
+
+    if hasattr(QuerySet, 'bulk_update'):
+        def bulk_update(self, objs, fields, batch_size=None):
+            dispatcher = get_dispatcher(self.model)
+            if dispatcher.investigator is None or dispatcher.is_suspended():
+                # nothing is watched or all watchers are suspended
+                return super(ObserverQuerySetMixin, self).bulk_update(
+                    objs, fields, batch_size=batch_size)
+            objs = list(objs)
+            snapshots = dispatcher.capture(
+                self.filter(pk__in=[x.pk for x in objs]))
+            rows = super(ObserverQuerySetMixin, self).bulk_update(
+                objs, fields, batch_size=batch_size)
+            dispatcher.dispatch_updated(snapshots, using=self.db)
+            return rows
+
+
+class ObserverQuerySet(ObserverQuerySetMixin, QuerySet):
+    """
+    A QuerySet which notifies the watchers of `update`
+    """
+    pass
+
+
+class ObserverManager(models.Manager):
+    """
+    A Manager which returns `ObserverQuerySet`
+    """
+    def get_queryset(self):
+        return ObserverQuerySet(self.model, using=self._db)
+
+    # Django < 1.6
+    get_query_set = get_queryset
+
+
+class ObserverModelMixin(object):
+    """
+    A model mixin which notifies the watchers of `delete` at once
+
+    The instance and the cascaded objects are captured with a single query
+    per model and watcher before the deletion and the callbacks are called
+    once per watcher after the deletion.
+    """
+    def delete(self, using=None, **kwargs):
+        # the same as Model.delete except that the collected objects are
+        # captured before the deletion
+        using = using or router.db_for_write(self.__class__, instance=self)
+        assert self.pk is not None, (
+            "%s object can't be deleted because its %s attribute is set "
+            "to None." % (self._meta.object_name, self._meta.pk.attname))
+        collector = Collector(using=using)
+        # e.g. keep_parents in Django 1.9 or later
+        collector.collect([self], **kwargs)
+        return delete_collected(collector)
+    delete.alters_data = True
@@ -8,3 +8,12 @@ def watch(model, attr, callback, **kwargs):
     watcher = AutoWatcher(model, attr, callback, **kwargs)
     watcher.lazy_watch()
     return watcher
+
+
+def bulk(objs=None):
+    """
+    A shortcut context manager for collecting saves and calling the
+    watchers once per model at the end of the context
+    """
+    from observer.dispatcher import bulk
+    return bulk(objs)
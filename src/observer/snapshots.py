@@ -0,0 +1,472 @@
+# coding=utf-8
+"""
+A process-wide snapshot registry of django-observer
+"""
+__author__ = 'Alisue <lambdalisue@hashnote.net>'
+import time
+import threading
+from django.db.models.base import ModelState
+from django.db.models.signals import post_init
+from django.db.models.signals import post_save
+from observer.conf import settings
+from observer.compat import OrderedDict
+from observer.utils.signals import register_reciever
+
+
+LOADED_SNAPSHOT_NAME = '_observer_loaded_snapshot'
+PREPARED_SNAPSHOT_NAME = '_observer_prepared_snapshots'
+
+
+def build_snapshot(model, values, db=None):
+    """
+    Build a detached instance of the model from the specified values
+
+    The instance is built without calling `__init__` thus no query is executed
+    and no signal is sent. Fields which are not in the values are not set.
+
+    Args:
+        model (model): A model class
+        values (dict): A mapping of field attname and value
+        db (None, str): A database alias the values came from
+
+    Returns:
+        instance
+    """
+    snapshot = model.__new__(model)
+    snapshot.__dict__.update(values)
+    snapshot._state = ModelState()
+    snapshot._state.adding = False
+    snapshot._state.db = db
+    return snapshot
+
+
+def capture_snapshot(model, instance, attnames=None):
+    """
+    Capture a snapshot of the current field values of the instance
+
+    Args:
+        model (model): A model class of the instance
+        instance (instance): A model instance
+        attnames (None, list, tuple): A field attname list which will be
+            captured. All fields are captured if it is not specified
+
+    Returns:
+        instance
+    """
+    values = instance.__dict__
+    if attnames is None:
+        attnames = [x.attname for x in model._meta.fields]
+    return build_snapshot(model, dict((x, values[x])
+                                      for x in attnames if x in values))
+
+
+_missing = object()
+
+
+class SnapshotStore(object):
+    """
+    A bounded mapping of snapshots with LRU and TTL eviction
+
+    The least recently used entry is evicted when the number of entries
+    exceeds `maxsize` and an entry is expired when `timeout` seconds has
+    passed after it was stored. The number of hits, misses and evictions is
+    counted to tell the efficiency of the store.
+    The store is guarded by a lock because it is shared by the threads.
+    """
+    def __init__(self, maxsize=None, timeout=None):
+        """
+        Construct snapshot store
+
+        Args:
+            maxsize (None, int): The maximum number of entries. Unlimited if
+                it is not specified
+            timeout (None, int): The lifetime of entries in seconds.
+                Unlimited if it is not specified
+        """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get_entry(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        expires = None
+        if self.timeout:
+            expires = time.time() + self.timeout
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            self.purge()
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._entries[key]
+
+    def _get_entry(self, key):
+        # it must be called with the lock
+        entry = self._entries.get(key, None)
+        if entry is not None and entry[1] is not None \
+                and entry[1] <= time.time():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        """
+        Get a stored value of the key and mark it as recently used
+        """
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # move the entry to the end (most recently used)
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def pop(self, key, default=None):
+        """
+        Remove the key and return the stored value
+        """
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            del self._entries[key]
+            return entry[0]
+
+    def purge(self):
+        """
+        Evict expired entries and the least recently used entries which
+        exceed `maxsize`
+        """
+        now = time.time()
+        with self._lock:
+            while self._entries:
+                key = next(iter(self._entries))
+                expires = self._entries[key][1]
+                overflow = (self.maxsize and
+                            len(self._entries) > self.maxsize)
+                if not overflow and (expires is None or expires > now):
+                    break
+                del self._entries[key]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return a dictionary of size, hits, misses and evictions
+        """
+        return dict(size=self.size,
+                    hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions)
+
+
+class SnapshotRegistry(object):
+    """
+    A registry of pre-save snapshots keyed by model class
+
+    Investigators of the same model share the registry so the row of the
+    instance is fetched only once per save, no matter how many watchers are
+    watching the model. Call 'prepare' method just before save the instance
+    and 'consume' method after the instance is saved.
+
+    If the model is registered with 'capture_on_load' method, the snapshots
+    are captured when the instances are loaded and no query is executed in
+    'prepare' method for the loaded instances.
+
+    The snapshots prepared for a save are kept on the instance and the
+    registry is guarded by a lock because it is shared by the threads.
+    Snapshots are removed from the store once all investigators consumed them
+    and the stores are bounded by `OBSERVER_SNAPSHOT_CACHE_SIZE` and
+    `OBSERVER_SNAPSHOT_CACHE_TIMEOUT` to keep the memory usage constant.
+    """
+    def __init__(self, maxsize=_missing, timeout=_missing):
+        """
+        Construct snapshot registry
+
+        Args:
+            maxsize (None, int): The maximum number of snapshots stored per
+                model. `OBSERVER_SNAPSHOT_CACHE_SIZE` is used if it is not
+                specified
+            timeout (None, int): The lifetime of snapshots in seconds.
+                `OBSERVER_SNAPSHOT_CACHE_TIMEOUT` is used if it is not
+                specified
+        """
+        if maxsize is _missing:
+            maxsize = settings.OBSERVER_SNAPSHOT_CACHE_SIZE
+        if timeout is _missing:
+            timeout = settings.OBSERVER_SNAPSHOT_CACHE_TIMEOUT
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._stores = {}
+        self._capturing = set()
+        self._field_names = {}
+        self._attnames = {}
+        self._lock = threading.RLock()
+
+    def get_store(self, model):
+        """
+        Get a snapshot store (a mapping of pk and snapshot) of the model
+
+        Args:
+            model (model): A model class
+
+        Returns:
+            SnapshotStore
+        """
+        with self._lock:
+            if model not in self._stores:
+                self._stores[model] = SnapshotStore(self.maxsize,
+                                                    self.timeout)
+            return self._stores[model]
+
+    def register_fields(self, model, field_names=None):
+        """
+        Register field names which are required in snapshots of the model
+
+        The snapshots contain the union of the registered field names and the
+        primary key of the model.
+
+        Args:
+            model (model): A model class
+            field_names (None, list, tuple): A field name list. All fields
+                are required if it is not specified
+        """
+        registered = self._field_names.get(model, set())
+        if registered is None or field_names is None:
+            self._field_names[model] = None
+        else:
+            self._field_names[model] = registered | set(field_names)
+        self._attnames.pop(model, None)
+
+    def get_fields(self, model):
+        """
+        Get a list of fields which are required in snapshots of the model
+
+        Args:
+            model (model): A model class
+
+        Returns:
+            list
+        """
+        field_names = self._field_names.get(model, None)
+        meta = model._meta
+        if field_names is None:
+            return list(meta.fields)
+        return [x for x in meta.fields
+                if x.name in field_names or x.primary_key]
+
+    def get_attnames(self, model):
+        """
+        Get a list of attnames of the fields which are required in snapshots
+        of the model
+
+        Args:
+            model (model): A model class
+
+        Returns:
+            list
+        """
+        attnames = self._attnames.get(model, None)
+        if attnames is None:
+            attnames = [x.attname for x in self.get_fields(model)]
+            self._attnames[model] = attnames
+        return attnames
+
+    def capture_on_load(self, model):
+        """
+        Capture snapshots of the instances of the model on load
+
+        The original values of the required fields (see 'register_fields')
+        are recorded on the instance when the instance is initialized with a
+        primary key (e.g. loaded from the database) and refreshed after the
+        instance is saved. Notice that an instance constructed manually with
+        a primary key is assumed to have the same values as the database.
+
+        Args:
+            model (model): A model class
+
+        Returns:
+            bool: True for new registration, False for already registered.
+        """
+        if model in self._capturing:
+            return False
+        register_reciever(model, post_init,
+                          self._post_init_receiver)
+        register_reciever(model, post_save,
+                          self._post_save_receiver)
+        self._capturing.add(model)
+        return True
+
+    def get_loaded(self, model, instance):
+        """
+        Get a snapshot of the instance captured on load
+
+        It returns None when the snapshot lacks some of the required fields
+        (e.g. the fields are registered after the instance is loaded).
+
+        Args:
+            model (model): A model class of the instance
+            instance (instance): A model instance
+
+        Returns:
+            object or None
+        """
+        if model not in self._capturing:
+            return None
+        snapshot = instance.__dict__.get(LOADED_SNAPSHOT_NAME, None)
+        if snapshot is None:
+            return None
+        values = snapshot.__dict__
+        for attname in self.get_attnames(model):
+            if attname not in values:
+                return None
+        return snapshot
+
+    def get_prepared(self, model, instance):
+        """
+        Get a snapshot of the instance prepared for the current save
+
+        Args:
+            model (model): A model class of the instance
+            instance (instance): A model instance
+
+        Returns:
+            object or None
+        """
+        prepared = instance.__dict__.get(PREPARED_SNAPSHOT_NAME, {})
+        entry = prepared.get(model, None)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def prepare(self, model, instance, fetch):
+        """
+        Fetch and store a snapshot of the instance
+
+        The snapshot is fetched only when it has not been fetched for the
+        current save of the instance yet. Otherwise the stored snapshot is
+        shared. The snapshot is kept on the instance thus the saves of the
+        different instances of the same row do not overwrite each other.
+
+        Args:
+            model (model): A model class of the instance
+            instance (instance): A model instance which is going to be saved
+            fetch (fn): A function which is called with the primary key and
+                return the snapshot
+
+        Returns:
+            object or None
+        """
+        pk = instance.pk
+        with self._lock:
+            prepared = instance.__dict__.setdefault(PREPARED_SNAPSHOT_NAME,
+                                                    {})
+            entry = prepared.get(model, None)
+            if entry is not None and not entry[2]:
+                # the snapshot has already fetched for this save
+                entry[1] += 1
+                return entry[0]
+        snapshot = self.get_loaded(model, instance)
+        if snapshot is None:
+            snapshot = fetch(pk)
+        with self._lock:
+            # (snapshot, the number of consumers, consumption started)
+            prepared[model] = [snapshot, 1, False]
+            self.get_store(model)[pk] = snapshot
+        return snapshot
+
+    def consume(self, model, instance):
+        """
+        Get a snapshot of the instance prepared for the current save
+
+        It returns None when the snapshot of the instance has not been
+        prepared (e.g. the instance is newly created).
+
+        Args:
+            model (model): A model class of the instance
+            instance (instance): A model instance which has been saved
+
+        Returns:
+            object or None
+        """
+        with self._lock:
+            prepared = instance.__dict__.get(PREPARED_SNAPSHOT_NAME, {})
+            entry = prepared.get(model, None)
+            if entry is None:
+                return None
+            # mark the entry so that nested saves fetch a new snapshot
+            entry[1] -= 1
+            entry[2] = True
+            snapshot = entry[0]
+            if entry[1] > 0:
+                return snapshot
+            # all investigators consumed the snapshot thus remove it
+            del prepared[model]
+            store = self.get_store(model)
+            if store.get(instance.pk, None) is snapshot:
+                del store[instance.pk]
+            return snapshot
+
+    def _post_init_receiver(self, sender, instance, **kwargs):
+        if instance.pk is None:
+            return
+        snapshot = capture_snapshot(sender, instance,
+                                    self.get_attnames(sender))
+        instance.__dict__[LOADED_SNAPSHOT_NAME] = snapshot
+
+    def _post_save_receiver(self, sender, instance, **kwargs):
+        if kwargs.get('raw', False):
+            return
+        update_fields = kwargs.get('update_fields', None)
+        snapshot = instance.__dict__.get(LOADED_SNAPSHOT_NAME, None)
+        if update_fields is None or snapshot is None:
+            snapshot = capture_snapshot(sender, instance,
+                                        self.get_attnames(sender))
+        else:
+            # only the specified fields have been written to the database.
+            # do not modify the previous snapshot while it might be used to
+            # investigate this save
+            fields = self.get_fields(sender)
+            values = dict((x.attname, snapshot.__dict__[x.attname])
+                          for x in fields
+                          if x.attname in snapshot.__dict__)
+            # update_fields may contain either names or attnames
+            for field in fields:
+                if field.name in update_fields or \
+                        field.attname in update_fields:
+                    values[field.attname] = instance.__dict__[field.attname]
+            snapshot = build_snapshot(sender, values)
+        instance.__dict__[LOADED_SNAPSHOT_NAME] = snapshot
+
+
+registry = SnapshotRegistry()
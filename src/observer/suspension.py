@@ -0,0 +1,150 @@
+# coding=utf-8
+"""
+Suspension of watchers of django-observer
+
+Watchers can be suspended globally, per model or per watcher without
+disconnecting any signal receivers. The state is local to the current thread
+(and the current context of asyncio if `contextvars` is available) thus the
+other threads are not affected.
+
+Example:
+    >>> with suspend():
+    ...     article.save()    # no watcher is called
+    >>> with suspend(Article):
+    ...     article.save()    # the watchers of Article are not called
+    >>> @suspend(watcher)
+    ... def import_articles():
+    ...     pass
+"""
+__author__ = 'Alisue <lambdalisue@hashnote.net>'
+import threading
+from functools import wraps
+from observer.compat import ContextVar
+
+
+# a marker which suspends all watchers
+ALL = object()
+
+_empty = frozenset()
+
+if ContextVar is not None:
+    _suspended = ContextVar('observer_suspended', default=_empty)
+
+    def get_suspended():
+        """
+        Get a set of the suspended targets of the current context
+        """
+        return _suspended.get()
+
+    def _set_suspended(suspended):
+        _suspended.set(suspended)
+else:
+    _local = threading.local()
+
+    def get_suspended():
+        """
+        Get a set of the suspended targets of the current thread
+        """
+        return getattr(_local, 'suspended', _empty)
+
+    def _set_suspended(suspended):
+        _local.suspended = suspended
+
+
+def is_suspended(*targets):
+    """
+    Return True if all watchers or any of the targets (models or watchers)
+    are suspended
+    """
+    suspended = get_suspended()
+    if not suspended:
+        return False
+    if ALL in suspended:
+        return True
+    for target in targets:
+        if target in suspended:
+            return True
+    return False
+
+
+def is_watcher_suspended(watcher):
+    """
+    Return True if the watcher, the model of the watcher or the watcher
+    owning the watcher (e.g. the inner watcher of `RelatedWatcher`) is
+    suspended
+    """
+    suspended = get_suspended()
+    if not suspended:
+        return False
+    if ALL in suspended:
+        return True
+    while watcher is not None:
+        if watcher in suspended or \
+                getattr(watcher, 'model', None) in suspended:
+            return True
+        watcher = getattr(watcher, 'owner', None)
+    return False
+
+
+def is_receiver_suspended(receiver):
+    """
+    Return True if the watcher of the receiver (a bound method of a watcher)
+    is suspended
+    """
+    return is_watcher_suspended(getattr(receiver, '__self__', None))
+
+
+class suspend(object):
+    """
+    A context manager (or a decorator) which suspends watchers
+
+    All watchers are suspended if no target is specified, otherwise the
+    watchers of the specified models and the specified watchers are
+    suspended. The snapshots of the saved instances are not fetched when all
+    watchers of the model are suspended.
+    """
+    def __init__(self, *targets):
+        """
+        Construct suspend context
+
+        Args:
+            *targets: Model classes or watcher instances
+        """
+        self.targets = frozenset(targets or (ALL,))
+        self._previous = []
+
+    def update(self, suspended):
+        return suspended | self.targets
+
+    def __enter__(self):
+        previous = get_suspended()
+        self._previous.append(previous)
+        _set_suspended(self.update(previous))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _set_suspended(self._previous.pop())
+
+    def __call__(self, fn):
+        targets = tuple(x for x in self.targets if x is not ALL)
+
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            # use a new context to be used in threads concurrently
+            with self.__class__(*targets):
+                return fn(*args, **kwargs)
+        return inner
+
+
+class resume(suspend):
+    """
+    A context manager (or a decorator) which resumes suspended watchers
+
+    All watchers are resumed if no target is specified, otherwise the
+    specified targets are resumed. Notice that the targets are not resumed
+    while all watchers are suspended.
+    """
+    def update(self, suspended):
+        if ALL in self.targets:
+            return _empty
+        return suspended - self.targets
@@ -1,3 +1,9 @@
 from test_utils import *
 from test_watchers import *
 from test_investigator import *
+from test_snapshots import *
+from test_benchmarks import *
+from test_dispatcher import *
+from test_backends import *
+from test_query import *
+from test_suspension import *
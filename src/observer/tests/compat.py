@@ -1,3 +1,4 @@
+import django
 try:
     # Python 3 have mock in unittest
     from unittest.mock import MagicMock, patch, DEFAULT, call
@@ -10,9 +11,9 @@ except ImportError:
     from override_settings import override_settings
 
 try:
-    from unittest import skip
+    from unittest import skip, skipIf
 except ImportError:
-    from unittest2 import skip
+    from unittest2 import skip, skipIf
 
 from django.test import TestCase
 
@@ -22,3 +23,31 @@ if not hasattr(TestCase, 'addCleanup'):
     import unittest2
     class TestCase(TestCase, unittest2.case.TestCase):
         pass
+
+try:
+    from django.test.utils import CaptureQueriesContext
+except ImportError:
+    # Django < 1.6 does not have CaptureQueriesContext
+    class CaptureQueriesContext(object):
+        def __init__(self, connection):
+            self.connection = connection
+
+        def __len__(self):
+            return len(self.captured_queries)
+
+        @property
+        def captured_queries(self):
+            return self.connection.queries[self.initial_queries:]
+
+        def __enter__(self):
+            self.use_debug_cursor = self.connection.use_debug_cursor
+            self.connection.use_debug_cursor = True
+            self.initial_queries = len(self.connection.queries)
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.connection.use_debug_cursor = self.use_debug_cursor
+
+# Django 1.7 or later removes the objects of a reverse foreign key with
+# QuerySet.update (without signals) unless `bulk=False` is specified
+NON_BULK = dict(bulk=False) if django.VERSION >= (1, 7) else {}
@@ -6,6 +6,7 @@ __author__ = 'Alisue <lambdalisue@hashnote.net>'
 from django.db import models
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from observer.query import ObserverModelMixin
 
 
 def alias(name):
@@ -59,6 +60,13 @@ class ObserverTestArticle(models.Model):
         return "<Article %s>" % self.title
 
 
+@alias('ArticleProxy')
+class ObserverTestArticleProxy(ObserverModelMixin, ObserverTestArticle):
+    class Meta:
+        app_label = 'observer'
+        proxy = True
+
+
 # connected from Article =====================================================
 @alias('User')
 class ObserverTestUser(models.Model):
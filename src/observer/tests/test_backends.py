@@ -0,0 +1,346 @@
+import sys
+import threading
+from django.db import connection
+from django.db import transaction
+from django.core.exceptions import ImproperlyConfigured
+from observer.tests.compat import TestCase
+from observer.tests.compat import MagicMock, patch
+from observer.tests.compat import skipIf
+from observer.tests.models import Article
+from observer.tests.factories import ArticleFactory
+from observer.investigator import Change, RelationDiff
+from observer.watchers.value import ValueWatcher
+from observer.compat import ThreadPoolExecutor
+from observer.compat import asyncio
+from observer.compat import is_commit_hook_pending
+from observer.backends import (merge_changes,
+                               merge_diffs,
+                               get_backend,
+                               ImmediateBackend,
+                               OnCommitBackend,
+                               ThreadPoolBackend,
+                               AsyncioBackend)
+
+
+class ObserverBackendsMergeChangesTestCase(TestCase):
+    def test_merge_changes_keep_first_old_and_last_new(self):
+        """merge_changes should keep the first old and the last new value"""
+        r = merge_changes([Change('title', 'a', 'b')],
+                          [Change('title', 'b', 'c'),
+                           Change('content', 'a', 'b')])
+        self.assertEqual(r, [Change('title', 'a', 'c'),
+                             Change('content', 'a', 'b')])
+
+    def test_merge_changes_return_none(self):
+        """merge_changes should return None if any of changes is None"""
+        self.assertIsNone(merge_changes(None, [Change('title', 'a', 'b')]))
+        self.assertIsNone(merge_changes([Change('title', 'a', 'b')], None))
+
+
+class ObserverBackendsMergeDiffsTestCase(TestCase):
+    def test_merge_diffs_apply_in_order(self):
+        """merge_diffs should apply the diffs in order"""
+        r = merge_diffs(RelationDiff.create(added=[1, 2], unchanged=[3]),
+                        RelationDiff.create(added=[4], removed=[2, 3]))
+        self.assertEqual(r, RelationDiff.create(added=[1, 4],
+                                                removed=[2, 3]))
+
+    def test_merge_diffs_return_none(self):
+        """merge_diffs should return None if any of diffs is None"""
+        self.assertIsNone(merge_diffs(None, RelationDiff.create()))
+
+
+class ObserverBackendsGetBackendTestCase(TestCase):
+    def test_get_backend_return_default_backend(self):
+        """get_backend should return the default backend"""
+        self.assertTrue(isinstance(get_backend(), ImmediateBackend))
+
+    def test_get_backend_return_same_instance(self):
+        """get_backend should return the same instance for a dotted path"""
+        path = 'observer.backends.ImmediateBackend'
+        self.assertTrue(get_backend(path) is get_backend(path))
+
+    def test_get_backend_return_instance(self):
+        """get_backend should return the specified instance as it is"""
+        backend = ImmediateBackend()
+        self.assertTrue(get_backend(backend) is backend)
+
+
+class ObserverBackendsOnCommitBackendTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'title'
+        self.callback = MagicMock()
+        # emulate commit hooks of a transaction
+        patcher = patch('observer.backends.has_commit_hooks',
+                        lambda using=None: True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend = OnCommitBackend()
+        self.watcher = ValueWatcher(self.model, self.attr, self.callback,
+                                    backend=self.backend)
+        self.watcher.watch()
+        self.addCleanup(self.watcher.unwatch)
+        self.hooks = []
+        patcher = patch('observer.backends.on_commit',
+                        lambda func, using=None: self.hooks.append(func))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('observer.backends.is_commit_hook_pending',
+                        lambda func, using=None: func in self.hooks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def commit(self):
+        hooks, self.hooks = self.hooks, []
+        for hook in hooks:
+            hook()
+
+    def rollback(self):
+        self.hooks = []
+
+    def test_callback_called_on_commit(self):
+        """callback should be called when the transaction is committed"""
+        new_instance = ArticleFactory()
+        self.assertFalse(self.callback.called)
+        self.commit()
+        self.callback.assert_called_once_with(
+            obj=new_instance, attr=self.attr, sender=self.watcher)
+
+    def test_callback_called_once_on_commit(self):
+        """callback should be called once for multiple saves"""
+        new_instance = ArticleFactory()
+        for i in range(5):
+            new_instance.title = 'modified%d' % i
+            new_instance.save()
+        self.assertFalse(self.callback.called)
+        self.commit()
+        self.callback.assert_called_once_with(
+            obj=new_instance, attr=self.attr, sender=self.watcher)
+
+    def test_batch_callback_called_once_on_commit(self):
+        """batch callback should be called once with the merged objects"""
+        callback = MagicMock()
+        watcher = ValueWatcher(self.model, self.attr, callback,
+                               batch=True, backend=self.backend)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        a = ArticleFactory()
+        b = ArticleFactory()
+        a.title = 'modified'
+        a.save()
+        self.commit()
+        callback.assert_called_once_with(
+            objs=[a, b], attr=self.attr, sender=watcher)
+
+    def test_callback_not_called_on_rollback(self):
+        """callback should not be called when the transaction is rolled back"""
+        new_instance = ArticleFactory()
+        new_instance.title = 'modified'
+        new_instance.save()
+        self.rollback()
+        self.commit()
+        self.assertFalse(self.callback.called)
+
+    def test_batch_callback_not_called_with_rolled_back_objects(self):
+        """batch callback should not be called with rolled back objects"""
+        callback = MagicMock()
+        watcher = ValueWatcher(self.model, self.attr, callback,
+                               batch=True, backend=self.backend)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        ArticleFactory()
+        self.rollback()
+        b = ArticleFactory()
+        self.commit()
+        callback.assert_called_once_with(
+            objs=[b], attr=self.attr, sender=watcher)
+
+    def test_pending_calls_discarded_on_rollback(self):
+        """the queued calls should be discarded with the transaction"""
+        ArticleFactory()
+        self.rollback()
+        self.assertEqual(self.backend.get_pending('default'), ({}, None))
+
+
+class ObserverBackendsIsCommitHookPendingTestCase(TestCase):
+    def setUp(self):
+        self.func = MagicMock()
+        self.original = getattr(connection, 'run_on_commit', None)
+        self.addCleanup(self.restore)
+
+    def restore(self):
+        if self.original is None:
+            connection.__dict__.pop('run_on_commit', None)
+        else:
+            connection.run_on_commit = self.original
+
+    def test_return_true_for_registered_hook(self):
+        """is_commit_hook_pending should find the registered hook"""
+        connection.run_on_commit = [(set(), self.func)]
+        self.assertTrue(is_commit_hook_pending(self.func))
+        connection.run_on_commit = [(set(), self.func, False)]
+        self.assertTrue(is_commit_hook_pending(self.func))
+
+    def test_return_false_for_unknown_layout(self):
+        """is_commit_hook_pending should return False for unknown layouts"""
+        connection.run_on_commit = [self.func]
+        self.assertFalse(is_commit_hook_pending(self.func))
+        connection.run_on_commit = None
+        self.assertFalse(is_commit_hook_pending(self.func))
+
+
+@skipIf(hasattr(transaction, 'on_commit'), 'commit hooks are available')
+class ObserverBackendsOnCommitBackendUnavailableTestCase(TestCase):
+    def test_construct_raise_exception(self):
+        """OnCommitBackend should raise ImproperlyConfigured on startup"""
+        self.assertRaises(ImproperlyConfigured, OnCommitBackend)
+
+    def test_watcher_construct_raise_exception(self):
+        """watcher should raise ImproperlyConfigured on construction"""
+        self.assertRaises(ImproperlyConfigured, ValueWatcher,
+                          Article, 'title', MagicMock(),
+                          backend='observer.backends.OnCommitBackend')
+
+
+@skipIf(ThreadPoolExecutor is None, 'concurrent.futures is not available')
+class ObserverBackendsThreadPoolBackendTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'title'
+        self.values = []
+        self.callback = MagicMock(side_effect=lambda **kwargs:
+                                  self.values.append(kwargs['changes']))
+        self.backend = ThreadPoolBackend(max_workers=2)
+        self.addCleanup(self.backend.shutdown)
+        self.watcher = ValueWatcher(self.model, self.attr, self.callback,
+                                    call_on_created=False,
+                                    pass_changes=True,
+                                    backend=self.backend)
+        self.watcher.watch()
+        self.addCleanup(self.watcher.unwatch)
+
+    def test_callback_called_in_worker(self):
+        """callback should be called in a worker thread"""
+        new_instance = ArticleFactory()
+        old_title = new_instance.title
+        new_instance.title = 'modified'
+        new_instance.save()
+        self.backend.wait()
+        self.callback.assert_called_once_with(
+            obj=new_instance, attr=self.attr, sender=self.watcher,
+            changes=[Change('title', old_title, 'modified')])
+
+    def test_callback_called_in_order(self):
+        """callback should be called in order of the modifications"""
+        new_instance = ArticleFactory()
+        for i in range(10):
+            new_instance.title = 'modified%d' % i
+            new_instance.save()
+        self.backend.wait()
+        self.assertEqual([x[0].new for x in self.values],
+                         ['modified%d' % i for i in range(10)])
+
+    def test_stats(self):
+        """stats should return the number of the calls"""
+        self.callback.side_effect = [None, Exception]
+        new_instance = ArticleFactory()
+        for i in range(2):
+            new_instance.title = 'modified%d' % i
+            new_instance.save()
+        self.backend.wait()
+        stats = self.backend.stats()
+        self.assertEqual(stats['submitted'], 2)
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertGreaterEqual(stats['wait_time'], 0)
+        self.assertGreaterEqual(stats['callback_time'], 0)
+
+    @patch('observer.backends.close_old_connections')
+    def test_connections_closed_after_callback(self, close_old_connections):
+        """the connections should be closed after each callback"""
+        self.callback.side_effect = [None, Exception]
+        new_instance = ArticleFactory()
+        for i in range(2):
+            new_instance.title = 'modified%d' % i
+            new_instance.save()
+        self.backend.wait()
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+def coroutine_function(fn):
+    """
+    Return a coroutine function which calls the function with the kwargs
+
+    `async def` is compiled at runtime because the module must be parsed by
+    Python 2 (`asyncio.coroutine` is removed in Python 3.11)
+    """
+    namespace = dict(fn=fn)
+    exec(compile('async def coroutine(**kwargs):\n'
+                 '    fn(kwargs)\n', '<coroutine>', 'exec'), namespace)
+    return namespace['coroutine']
+
+
+@skipIf(asyncio is None or sys.version_info < (3, 5),
+        'asyncio and async def (Python 3.5 or later) are not available')
+class ObserverBackendsAsyncioBackendTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'title'
+        self.calls = []
+        self.backend = AsyncioBackend()
+
+        self.callback = coroutine_function(self.calls.append)
+
+    def watch(self, callback, **kwargs):
+        watcher = ValueWatcher(self.model, self.attr, callback,
+                               call_on_created=False, **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_coroutine_callback_use_asyncio_backend(self):
+        """coroutine function callbacks should use AsyncioBackend"""
+        watcher = self.watch(self.callback)
+        self.assertTrue(isinstance(watcher.backend, AsyncioBackend))
+
+    def test_coroutine_callback_called(self):
+        """coroutine function callbacks should be called in the loop"""
+        watcher = self.watch(self.callback, backend=self.backend)
+        new_instance = ArticleFactory()
+        new_instance.title = 'modified'
+        new_instance.save()
+        self.backend.wait(5)
+        self.assertEqual(self.calls, [
+            dict(obj=new_instance, attr=self.attr, sender=watcher),
+        ])
+
+    def test_callback_called(self):
+        """non coroutine function callbacks should be called in executor"""
+        callback = MagicMock()
+        watcher = self.watch(callback, backend=self.backend)
+        new_instance = ArticleFactory()
+        new_instance.title = 'modified'
+        new_instance.save()
+        self.backend.wait(5)
+        callback.assert_called_once_with(
+            obj=new_instance, attr=self.attr, sender=watcher)
+
+    def test_calls_batched(self):
+        """calls dispatched before the loop handles them should be batched"""
+        self.watch(self.callback, backend=self.backend)
+        flush = MagicMock(side_effect=self.backend._flush)
+        self.backend._flush = flush
+        # block the loop until all calls are dispatched
+        lock = threading.Lock()
+        lock.acquire()
+        self.backend.loop.call_soon_threadsafe(lock.acquire)
+        new_instance = ArticleFactory()
+        for i in range(5):
+            new_instance.title = 'modified%d' % i
+            new_instance.save()
+        lock.release()
+        self.backend.wait(5)
+        self.assertEqual(flush.call_count, 1)
+        self.assertEqual(len(self.calls), 5)
@@ -0,0 +1,127 @@
+import os
+import sys
+import timeit
+from observer.tests.compat import TestCase
+from observer.tests.compat import MagicMock, patch, skip
+from observer.tests.models import Article
+from observer.tests.factories import ArticleFactory
+from observer.investigator import Investigator, DiffPlan
+from observer.watchers.related import RelatedWatcherBase
+
+
+def benchmark(fn, number=1000, repeat=3):
+    """
+    Return the best execution time of the function per call in seconds
+    """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def report(name, **timings):
+    """
+    Print the timings of a benchmark. The timings are never asserted
+    """
+    timings = ', '.join('%s=%.2fus' % (key, value * 1e6)
+                        for key, value in sorted(timings.items()))
+    sys.stderr.write('\n%s: %s\n' % (name, timings))
+
+
+# the timings depend on the machine thus the benchmarks only report them and
+# they are skipped unless OBSERVER_BENCHMARK is set
+if os.environ.get('OBSERVER_BENCHMARK'):
+    def benchmark_only(fn):
+        return fn
+else:
+    benchmark_only = skip('set OBSERVER_BENCHMARK=1 to run the benchmarks')
+
+
+class ObserverBenchmarkDiffTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.investigator = Investigator(self.model)
+        self.old = ArticleFactory()
+        self.new = self.model.objects.get(pk=self.old.pk)
+        self.new.title = 'modified'
+
+    def naive_diff(self, old, new):
+        # the diff implementation without precompiled plan
+        field_names = self.investigator.get_field_names()
+        for field in self.model._meta.fields:
+            if field.name not in field_names:
+                continue
+            if getattr(old, field.attname, None) != \
+                    getattr(new, field.attname, None):
+                yield field.name
+
+    def test_diff_plan_compiled_once(self):
+        """the diff plan should be compiled once per investigator"""
+        plan = self.investigator.plan
+        with patch('observer.investigator.DiffPlan',
+                   wraps=DiffPlan) as factory:
+            for i in range(5):
+                self.assertTrue(self.investigator.plan is plan)
+            self.assertFalse(factory.called)
+
+    def test_diff_plan_extract_once_per_instance(self):
+        """the diff plan should extract the values once per instance"""
+        plan = self.investigator.plan
+        with patch.object(plan, 'extract', wraps=plan.extract) as extract:
+            self.assertEqual(list(plan.diff(self.old, self.new)), ['title'])
+        self.assertEqual(extract.call_count, 2)
+
+    def test_diff_plan_unmodified(self):
+        """the diff plan should not compare fields of unmodified saves"""
+        comparator = MagicMock(return_value=True)
+        plan = DiffPlan(['title'], ['title'], {'title': comparator})
+        self.new.title = self.old.title
+        self.assertEqual(list(plan.diff(self.old, self.new)), [])
+        self.assertFalse(comparator.called)
+
+    @benchmark_only
+    def test_benchmark_diff_plan(self):
+        """report the per-save cost of the diff plan and the naive diff"""
+        plan = self.investigator.plan
+        self.assertEqual(list(plan.diff(self.old, self.new)),
+                         list(self.naive_diff(self.old, self.new)))
+        for name in ('modified', 'unmodified'):
+            if name == 'unmodified':
+                self.new.title = self.old.title
+            report('diff (%s)' % name,
+                   naive=benchmark(
+                       lambda: list(self.naive_diff(self.old, self.new))),
+                   compiled=benchmark(
+                       lambda: list(plan.diff(self.old, self.new))))
+
+
+class ObserverBenchmarkRelationTestCase(TestCase):
+    def setUp(self):
+        self.watcher = RelatedWatcherBase(Article, 'projects', MagicMock())
+        self.watcher.resolve_relation()
+
+    def get_facts(self):
+        # the relation facts required on each save
+        return (self.watcher.is_reversed,
+                self.watcher.related_model,
+                self.watcher.related_attr)
+
+    def get_facts_naive(self):
+        # the relation facts resolved on each save (without memoization)
+        relation = self.watcher.resolve_relation()
+        return (relation['is_reversed'],
+                relation['related_model'],
+                relation['related_attr'])
+
+    def test_resolved_relation_not_resolved_on_access(self):
+        """the resolved relation facts should not be resolved on access"""
+        expected = self.get_facts_naive()
+        with patch.object(self.watcher, 'get_field') as get_field:
+            for i in range(5):
+                self.assertEqual(self.get_facts(), expected)
+            self.assertFalse(get_field.called)
+
+    @benchmark_only
+    def test_benchmark_resolved_relation(self):
+        """report the per-save cost of the resolved relation facts"""
+        self.assertEqual(self.get_facts(), self.get_facts_naive())
+        report('relation facts',
+               naive=benchmark(self.get_facts_naive),
+               resolved=benchmark(self.get_facts))
@@ -0,0 +1,216 @@
+from django.db.models.signals import pre_save
+from django.db.models.signals import post_save
+from observer.tests.compat import TestCase
+from observer.tests.compat import MagicMock, patch
+from observer.tests.models import Article
+from observer.tests.factories import ArticleFactory
+from observer.investigator import Change, Investigator
+from observer.dispatcher import Dispatcher, get_dispatcher, bulk
+from observer.watchers.value import ValueWatcher
+
+
+class ObserverDispatcherTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        # test the routing without connecting the receivers to the signals
+        # of the model (they are never disconnected)
+        patcher = patch.object(Dispatcher, '_connect_signal')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dispatcher = Dispatcher(self.model)
+        self.title_receiver = MagicMock()
+        self.content_receiver = MagicMock()
+        self.wildcard_receiver = MagicMock()
+        self.dispatcher.connect(self.title_receiver, ['title'])
+        self.dispatcher.connect(self.content_receiver, ['content'])
+        self.dispatcher.connect(self.wildcard_receiver)
+
+    def test_route_return_receivers_of_changes(self):
+        """route should return only the receivers of the modified fields"""
+        changes = [Change('title', 'old', 'new')]
+        self.assertEqual(self.dispatcher.route(changes), [
+            (self.title_receiver, changes),
+            (self.wildcard_receiver, changes),
+        ])
+
+    def test_route_return_routed_changes(self):
+        """route should return only the changes of the fields interest"""
+        title = Change('title', 'old', 'new')
+        content = Change('content', 'old', 'new')
+        self.assertEqual(self.dispatcher.route([title, content]), [
+            (self.title_receiver, [title]),
+            (self.content_receiver, [content]),
+            (self.wildcard_receiver, [title, content]),
+        ])
+
+    def test_route_not_return_disconnected_receivers(self):
+        """route should not return disconnected receivers"""
+        self.dispatcher.disconnect(self.title_receiver)
+        self.dispatcher.disconnect(self.wildcard_receiver)
+        changes = [Change('title', 'old', 'new')]
+        self.assertEqual(self.dispatcher.route(changes), [])
+
+    def test_get_dispatcher_return_same_dispatcher(self):
+        """get_dispatcher should return the same dispatcher for a model"""
+        self.assertTrue(get_dispatcher(self.model) is
+                        get_dispatcher(self.model))
+
+
+class ObserverDispatcherWatcherTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.title_callback = MagicMock()
+        self.content_callback = MagicMock()
+
+    def watch(self, attr, callback):
+        watcher = ValueWatcher(self.model, attr, callback,
+                               call_on_created=False)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_receivers_not_increase_with_watchers(self):
+        """the number of signal receivers should not increase"""
+        self.watch('title', self.title_callback)
+        receivers = len(post_save.receivers)
+        for i in range(10):
+            self.watch('title', self.title_callback)
+        self.assertEqual(len(post_save.receivers), receivers)
+
+    def test_only_watchers_of_modified_fields_called(self):
+        """only the watchers of the modified fields should be called"""
+        self.watch('title', self.title_callback)
+        self.watch('content', self.content_callback)
+        article = ArticleFactory()
+        article.title = 'modified'
+        article.save()
+        self.assertEqual(self.title_callback.call_count, 1)
+        self.assertFalse(self.content_callback.called)
+
+    def test_unwatched_watchers_not_called(self):
+        """unwatched watchers should not be called"""
+        watcher = self.watch('title', self.title_callback)
+        watcher.unwatch()
+        article = ArticleFactory()
+        article.title = 'modified'
+        article.save()
+        self.assertFalse(self.title_callback.called)
+
+
+class ObserverDispatcherBulkTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'title'
+        self.callback = MagicMock()
+        self.articles = [ArticleFactory() for i in range(3)]
+
+    def watch(self, **kwargs):
+        watcher = ValueWatcher(self.model, self.attr, self.callback,
+                               **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_callback_called_at_the_end(self):
+        """batch callback should be called once at the end of bulk"""
+        watcher = self.watch(batch=True)
+        with bulk(self.articles):
+            for article in self.articles:
+                article.title = 'modified'
+                article.save()
+            self.assertFalse(self.callback.called)
+        self.callback.assert_called_once_with(
+            objs=self.articles, attr=self.attr, sender=watcher)
+
+    def test_callback_called_once_per_instance(self):
+        """callback should be called once for multiple saves"""
+        watcher = self.watch(pass_changes=True)
+        article = self.articles[0]
+        old_title = article.title
+        with bulk([article]):
+            for i in range(3):
+                article.title = 'modified%d' % i
+                article.save()
+        self.callback.assert_called_once_with(
+            obj=article, attr=self.attr, sender=watcher,
+            changes=[Change('title', old_title, 'modified2')])
+
+    def test_created_callback_called_at_the_end(self):
+        """callback should be called with the created objects at the end"""
+        watcher = self.watch(batch=True)
+        with bulk():
+            articles = [ArticleFactory() for i in range(2)]
+            self.assertFalse(self.callback.called)
+        self.callback.assert_called_once_with(
+            objs=articles, attr=self.attr, sender=watcher)
+
+    def test_snapshots_prefetched(self):
+        """snapshots should be fetched with a query on enter"""
+        self.watch()
+        with self.assertNumQueries(1):
+            with bulk(self.articles):
+                pass
+        with patch.object(Investigator, 'get_object') as get_object:
+            with bulk(self.articles):
+                for article in self.articles:
+                    article.save()
+            self.assertFalse(get_object.called)
+
+    def save_and_raise(self):
+        with bulk(self.articles):
+            self.articles[0].title = 'modified'
+            self.articles[0].save()
+            raise KeyError
+
+    @patch('observer.dispatcher.has_commit_hooks', lambda using=None: False)
+    def test_callback_not_called_on_exception_in_transaction(self):
+        """callback should not be called on exception without commit hooks"""
+        self.watch()
+        self.assertRaises(KeyError, self.save_and_raise)
+        self.assertFalse(self.callback.called)
+
+    @patch('observer.dispatcher.is_in_transaction', lambda using=None: False)
+    def test_callback_called_on_exception_in_autocommit(self):
+        """callback should be called with the saved objects on exception"""
+        watcher = self.watch()
+        self.assertRaises(KeyError, self.save_and_raise)
+        self.callback.assert_called_once_with(
+            obj=self.articles[0], attr=self.attr, sender=watcher)
+
+    @patch('observer.dispatcher.has_commit_hooks', lambda using=None: True)
+    def test_callback_called_on_commit_after_exception(self):
+        """callback should be called on commit of the enclosing block"""
+        watcher = self.watch()
+        hooks = []
+        with patch('observer.dispatcher.on_commit',
+                   lambda func, using=None: hooks.append(func)):
+            self.assertRaises(KeyError, self.save_and_raise)
+        self.assertFalse(self.callback.called)
+        self.assertEqual(len(hooks), 1)
+        hooks[0]()
+        self.callback.assert_called_once_with(
+            obj=self.articles[0], attr=self.attr, sender=watcher)
+
+    @patch('observer.dispatcher.is_in_transaction', lambda using=None: False)
+    def test_callback_not_called_for_failed_save(self):
+        """callback should not be called for the objects failed to be saved"""
+        self.watch()
+
+        def fail(**kwargs):
+            raise KeyError
+        pre_save.connect(fail, sender=self.model)
+        self.addCleanup(pre_save.disconnect, fail, sender=self.model)
+        self.assertRaises(KeyError, self.save_and_raise)
+        self.assertFalse(self.callback.called)
+
+    def test_state_reset_on_prefetch_exception(self):
+        """bulk should not be active after the prefetch failed"""
+        self.watch()
+        with patch.object(Dispatcher, 'prefetch', side_effect=KeyError):
+            def enter():
+                with bulk(self.articles):
+                    pass
+            self.assertRaises(KeyError, enter)
+        self.articles[0].title = 'modified'
+        self.articles[0].save()
+        self.assertEqual(self.callback.call_count, 1)
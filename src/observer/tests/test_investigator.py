@@ -1,9 +1,13 @@
+from django.db import connection
 from django.core.exceptions import ObjectDoesNotExist
 from observer.tests.models import Article
 from observer.tests.factories import ArticleFactory
+from observer.tests.factories import UserFactory
 from observer.tests.compat import TestCase
 from observer.tests.compat import MagicMock
-from observer.investigator import Investigator
+from observer.tests.compat import CaptureQueriesContext
+from observer.investigator import Investigator, Change
+from observer.snapshots import SnapshotRegistry
 
 
 class ObserverInvestigatorTestCase(TestCase):
@@ -110,7 +114,7 @@ class ObserverInvestigatorTestCase(TestCase):
 
     def test_investigate_not_yield_created(self):
         """investigate should not yields anythong on creation"""
-        article = ArticleFactory.build()
+        article = ArticleFactory.build(supplement=None, author=None)
         article.title = 'modified'
         article.content = 'modified'
         # call prepare before save
@@ -152,3 +156,113 @@ class ObserverInvestigatorTestCase(TestCase):
         self.assertEqual(set(list(iterator)), set([
             'title',
         ]))
+
+    def test_investigate_yield_modified_relational_attributes(self):
+        """investigate should yields modified relational attribute names"""
+        article = ArticleFactory()
+        article.author = UserFactory()
+        self.investigator.prepare(article)
+        article.save()
+        iterator = self.investigator.investigate(article)
+        self.assertEqual(set(list(iterator)), set([
+            'author',
+        ]))
+
+    def test_investigate_not_query_related_objects(self):
+        """investigate should not query related objects"""
+        article = self.model.objects.get(pk=ArticleFactory().pk)
+        article.title = 'modified'
+        self.investigator.prepare(article)
+        article.save()
+        with self.assertNumQueries(0):
+            iterator = self.investigator.investigate(article)
+            self.assertEqual(set(list(iterator)), set([
+                'title',
+            ]))
+
+    def test_investigate_compare_related_objects(self):
+        """investigate should compare related objects with compare_related"""
+        investigator = Investigator(self.model, compare_related=True)
+        article = ArticleFactory()
+        article.author = UserFactory()
+        investigator.prepare(article)
+        article.save()
+        iterator = investigator.investigate(article)
+        self.assertEqual(set(list(iterator)), set([
+            'author',
+        ]))
+
+    def test_get_object_fetch_included_columns(self):
+        """get_object should fetch only the included columns"""
+        investigator = Investigator(self.model, include=['title'],
+                                    registry=SnapshotRegistry())
+        article = ArticleFactory(title='original')
+        with CaptureQueriesContext(connection) as context:
+            r = investigator.get_object(article.pk)
+        self.assertEqual(len(context), 1)
+        self.assertFalse('content' in context.captured_queries[0]['sql'])
+        self.assertEqual(r.pk, article.pk)
+        self.assertEqual(r.title, 'original')
+        self.assertFalse('content' in r.__dict__)
+
+    def test_get_object_fetch_required_columns(self):
+        """get_object should fetch the required columns as well"""
+        investigator = Investigator(self.model, include=['title'],
+                                    require=['author'],
+                                    registry=SnapshotRegistry())
+        article = ArticleFactory()
+        r = investigator.get_object(article.pk)
+        self.assertEqual(r.author_id, article.author_id)
+        self.assertFalse('content' in r.__dict__)
+
+    def test_investigate_use_comparators(self):
+        """investigate should use the specified comparators"""
+        investigator = Investigator(self.model, comparators={
+            'title': lambda old, new: old.lower() != new.lower(),
+        })
+        article = ArticleFactory(title='title')
+        article.title = 'TITLE'
+        article.content = 'modified'
+        investigator.prepare(article)
+        article.save()
+        iterator = investigator.investigate(article)
+        self.assertEqual(set(list(iterator)), set([
+            'content',
+        ]))
+
+    def test_investigate_changes_return_change_records(self):
+        """investigate_changes should return old and new values"""
+        article = ArticleFactory(title='original')
+        article.title = 'modified'
+        self.investigator.prepare(article)
+        article.save()
+        changes = self.investigator.investigate_changes(article)
+        self.assertEqual(changes, [
+            Change('title', 'original', 'modified'),
+        ])
+
+    def test_prepare_not_query_with_unrelated_update_fields(self):
+        """prepare should not query if update_fields is not investigated"""
+        investigator = Investigator(self.model, include=['title'])
+        article = ArticleFactory()
+        article.title = 'modified'
+        article.content = 'modified'
+        with self.assertNumQueries(0):
+            investigator.prepare(article, update_fields=['content'])
+        article.save(update_fields=['content'])
+        iterator = investigator.investigate(article,
+                                            update_fields=['content'])
+        self.assertEqual(set(list(iterator)), set())
+
+    def test_investigate_yield_update_fields_attributes(self):
+        """investigate should yields only modified update_fields names"""
+        article = ArticleFactory()
+        article.title = 'modified'
+        article.content = 'modified'
+        self.investigator.prepare(article, update_fields=['content'])
+        article.save(update_fields=['content'])
+        iterator = self.investigator.investigate(article,
+                                                 update_fields=['content'])
+        self.assertEqual(set(list(iterator)), set([
+            'content',
+        ]))
@@ -0,0 +1,197 @@
+from django.db.models.deletion import Collector
+from observer.tests.compat import TestCase
+from observer.tests.compat import MagicMock, patch
+from observer.tests.models import Article, ArticleProxy
+from observer.tests.models import Supplement, Project
+from observer.tests.factories import (ArticleFactory,
+                                      SupplementFactory,
+                                      ProjectFactory)
+from observer.investigator import Change, RelationDiff
+from observer.dispatcher import get_dispatcher
+from observer.watchers.value import ValueWatcher
+from observer.watchers.related import ManyRelatedWatcher
+from observer.query import ObserverQuerySet
+
+
+class ObserverQueryObserverQuerySetTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'title'
+        self.callback = MagicMock()
+        self.articles = [ArticleFactory() for i in range(3)]
+        self.queryset = ObserverQuerySet(self.model)
+
+    def watch(self, **kwargs):
+        watcher = ValueWatcher(self.model, self.attr, self.callback,
+                               call_on_created=False, **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_callback_called_on_update(self):
+        """callback should be called for each updated object"""
+        watcher = self.watch(pass_changes=True)
+        self.queryset.filter(pk=self.articles[0].pk).update(title='modified')
+        self.callback.assert_called_once_with(
+            obj=self.articles[0], attr=self.attr, sender=watcher,
+            changes=[Change('title', self.articles[0].title, 'modified')])
+
+    def test_callback_not_called_on_update_with_non_interest_attr(self):
+        """callback should not be called when the attr is not modified"""
+        self.watch()
+        self.queryset.update(content='modified')
+        self.assertFalse(self.callback.called)
+
+    def test_batch_callback_called_once_on_update(self):
+        """batch callback should be called once with the updated objects"""
+        self.watch(batch=True)
+        self.queryset.update(title='modified')
+        self.assertEqual(self.callback.call_count, 1)
+        self.assertEqual(set(self.callback.call_args[1]['objs']),
+                         set(self.articles))
+
+    def test_update_query_count(self):
+        """update should capture and load the objects with a query each"""
+        self.watch()
+        with self.assertNumQueries(3):
+            self.queryset.update(title='modified')
+
+    def test_update_query_count_without_watchers(self):
+        """update should not execute extra queries without watchers"""
+        SupplementFactory()
+        with self.assertNumQueries(1):
+            ObserverQuerySet(Supplement).update(label='modified')
+
+
+class ObserverQueryObserverQuerySetBulkCreateTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'title'
+        self.callback = MagicMock()
+        self.queryset = ObserverQuerySet(self.model)
+
+    def watch(self, **kwargs):
+        watcher = ValueWatcher(self.model, self.attr, self.callback,
+                               **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def build(self, n):
+        return [self.model(title='title%d' % i) for i in range(n)]
+
+    def test_callback_called_on_bulk_create(self):
+        """callback should be called for each created object"""
+        self.watch()
+        objs = self.queryset.bulk_create(self.build(3))
+        self.assertEqual([x[1]['obj'] for x in self.callback.call_args_list],
+                         objs)
+
+    def test_batch_callback_called_once_on_bulk_create(self):
+        """batch callback should be called once with the created objects"""
+        watcher = self.watch(batch=True)
+        objs = self.queryset.bulk_create(self.build(3))
+        self.callback.assert_called_once_with(
+            objs=objs, attr=self.attr, sender=watcher)
+
+    def test_callback_not_called_without_call_on_created(self):
+        """callback should not be called without call_on_created"""
+        self.watch(call_on_created=False)
+        self.queryset.bulk_create(self.build(3))
+        self.assertFalse(self.callback.called)
+
+    def test_bulk_create_query_count(self):
+        """bulk_create should not execute extra queries"""
+        self.watch(batch=True)
+        with self.assertNumQueries(1):
+            self.queryset.bulk_create(self.build(3))
+
+
+class ObserverQueryObserverQuerySetDeleteTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'projects'
+        self.callback = MagicMock()
+        self.projects = [ProjectFactory() for i in range(3)]
+        self.article = ArticleFactory(projects=self.projects)
+        self.queryset = ObserverQuerySet(Project)
+
+    def watch(self, **kwargs):
+        watcher = ManyRelatedWatcher(self.model, self.attr, self.callback,
+                                     call_on_created=False,
+                                     call_on_deleted=True,
+                                     pass_diff=True, **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_batch_callback_called_once_on_delete(self):
+        """batch callback should be called once with the affected objects"""
+        watcher = self.watch(batch=True)
+        self.queryset.delete()
+        self.callback.assert_called_once_with(
+            objs=[self.article], attr=self.attr, sender=watcher,
+            diff=RelationDiff.create(removed=[x.pk for x in self.projects]))
+
+    def test_callback_called_once_on_delete(self):
+        """callback should be called once per affected object"""
+        watcher = self.watch()
+        self.queryset.delete()
+        self.callback.assert_called_once_with(
+            obj=self.article, attr=self.attr, sender=watcher,
+            diff=RelationDiff.create(removed=[x.pk for x in self.projects]))
+
+    def test_capture_deleted_query_count(self):
+        """the deleted objects should be captured with a query"""
+        self.watch(batch=True)
+        with self.assertNumQueries(1):
+            get_dispatcher(Project).capture_deleted(self.queryset)
+
+    def test_callback_not_called_on_rollback(self):
+        """callback should not be called if the deletion fails"""
+        self.watch(batch=True)
+        with patch.object(Collector, 'delete', side_effect=Exception):
+            self.assertRaises(Exception, self.queryset.delete)
+        self.assertFalse(self.callback.called)
+
+
+class ObserverQueryObserverModelMixinTestCase(TestCase):
+    def setUp(self):
+        self.projects = [ProjectFactory() for i in range(10)]
+        self.article = ArticleFactory(projects=self.projects)
+        self.receiver = MagicMock()
+        self.capture = MagicMock(return_value=[])
+        self.capture_many = MagicMock(side_effect=lambda queryset: [
+            (x.pk, x.article_id) for x in queryset])
+        dispatcher = get_dispatcher(Project)
+        dispatcher.connect_deleted(self.receiver,
+                                   self.capture,
+                                   self.capture_many)
+        self.addCleanup(dispatcher.disconnect_deleted, self.receiver)
+
+    def assertCapturedAtOnce(self):
+        self.assertEqual(self.capture_many.call_count, 1)
+        self.assertFalse(self.capture.called)
+        self.assertEqual(self.receiver.call_count, 1)
+        pairs = self.receiver.call_args[0][0]
+        self.assertEqual(sorted(pairs), sorted(
+            (x.pk, self.article.pk) for x in self.projects))
+
+    def test_cascaded_deletions_captured_at_once(self):
+        """delete should capture the cascaded deletions at once"""
+        ArticleProxy.objects.get(pk=self.article.pk).delete()
+        self.assertCapturedAtOnce()
+        self.assertFalse(Project.objects.exists())
+
+    def test_cascaded_deletions_of_queryset_captured_at_once(self):
+        """ObserverQuerySet.delete should capture the cascaded deletions"""
+        ObserverQuerySet(Article).delete()
+        self.assertCapturedAtOnce()
+
+    def test_receiver_not_called_on_rollback(self):
+        """receiver should not be called if the deletion fails"""
+        with patch.object(Collector, 'delete', side_effect=Exception):
+            self.assertRaises(Exception,
+                              ArticleProxy.objects.get(
+                                  pk=self.article.pk).delete)
+        self.assertFalse(self.receiver.called)
@@ -0,0 +1,276 @@
+import threading
+from django.db import connection
+from observer.tests.compat import TestCase
+from observer.tests.compat import MagicMock, patch
+from observer.tests.compat import CaptureQueriesContext
+from observer.tests.models import Article
+from observer.tests.factories import ArticleFactory, UserFactory
+from observer.snapshots import SnapshotStore
+from observer.snapshots import SnapshotRegistry
+from observer.investigator import Investigator
+from observer.watchers.value import ValueWatcher
+
+
+class ObserverSnapshotStoreTestCase(TestCase):
+    def test_get_count_hits_and_misses(self):
+        """get should count hits and misses"""
+        store = SnapshotStore()
+        store[1] = 'foo'
+        self.assertEqual(store.get(1), 'foo')
+        self.assertEqual(store.get(2), None)
+        self.assertEqual(store.stats(), dict(size=1, hits=1, misses=1,
+                                             evictions=0))
+
+    def test_set_evict_least_recently_used(self):
+        """set should evict the least recently used entry"""
+        store = SnapshotStore(maxsize=2)
+        store[1] = 'foo'
+        store[2] = 'bar'
+        # mark 1 as recently used
+        store.get(1)
+        store[3] = 'hoge'
+        self.assertTrue(1 in store)
+        self.assertFalse(2 in store)
+        self.assertTrue(3 in store)
+        self.assertEqual(store.size, 2)
+        self.assertEqual(store.evictions, 1)
+
+    @patch('observer.snapshots.time')
+    def test_get_evict_expired(self, time):
+        """get should evict expired entries"""
+        time.time.return_value = 0
+        store = SnapshotStore(timeout=10)
+        store[1] = 'foo'
+        time.time.return_value = 5
+        self.assertEqual(store.get(1), 'foo')
+        time.time.return_value = 10
+        self.assertEqual(store.get(1), None)
+        self.assertEqual(store.size, 0)
+        self.assertEqual(store.evictions, 1)
+
+    def test_pop_remove_entry(self):
+        """pop should remove the entry"""
+        store = SnapshotStore()
+        store[1] = 'foo'
+        self.assertEqual(store.pop(1), 'foo')
+        self.assertEqual(store.size, 0)
+        self.assertRaises(KeyError, store.__getitem__, 1)
+
+    def test_concurrent_access(self):
+        """the store should be accessed from the threads concurrently"""
+        store = SnapshotStore(maxsize=4)
+        errors = []
+
+        def access(offset):
+            try:
+                for i in range(1000):
+                    key = (i + offset) % 8
+                    store[key] = i
+                    store.get(key)
+                    store.pop((key + 1) % 8)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=access, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(store.size, 4)
+
+
+class ObserverSnapshotRegistryTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.registry = SnapshotRegistry()
+        self.fetch = MagicMock(side_effect=lambda pk: MagicMock(pk=pk))
+
+    def test_get_store_return_same_store(self):
+        """get_store should return the same store for the same model"""
+        store = self.registry.get_store(self.model)
+        self.assertTrue(store is self.registry.get_store(self.model))
+
+    def test_prepare_fetch_once_per_save(self):
+        """prepare should fetch the snapshot only once per save"""
+        instance = MagicMock(pk=1)
+        snapshots = [self.registry.prepare(self.model, instance, self.fetch)
+                     for i in range(5)]
+        self.fetch.assert_called_once_with(1)
+        self.assertEqual(len(set(snapshots)), 1)
+
+    def test_prepare_fetch_for_each_save(self):
+        """prepare should fetch the snapshot again in the next save"""
+        instance = MagicMock(pk=1)
+        self.registry.prepare(self.model, instance, self.fetch)
+        self.registry.consume(self.model, instance)
+        self.registry.prepare(self.model, instance, self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_prepare_fetch_for_different_instance(self):
+        """prepare should fetch the snapshot for a different instance"""
+        self.registry.prepare(self.model, MagicMock(pk=1), self.fetch)
+        self.registry.prepare(self.model, MagicMock(pk=1), self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_consume_return_prepared_snapshot(self):
+        """consume should return the prepared snapshot to each consumer"""
+        instance = MagicMock(pk=1)
+        snapshot = self.registry.prepare(self.model, instance, self.fetch)
+        self.registry.prepare(self.model, instance, self.fetch)
+        self.assertEqual(self.registry.consume(self.model, instance),
+                         snapshot)
+        self.assertEqual(self.registry.consume(self.model, instance),
+                         snapshot)
+
+    def test_consume_remove_consumed_snapshot(self):
+        """consume should remove the snapshot consumed by all consumers"""
+        instance = MagicMock(pk=1)
+        store = self.registry.get_store(self.model)
+        self.registry.prepare(self.model, instance, self.fetch)
+        self.registry.prepare(self.model, instance, self.fetch)
+        self.registry.consume(self.model, instance)
+        self.assertEqual(store.size, 1)
+        self.registry.consume(self.model, instance)
+        self.assertEqual(store.size, 0)
+
+    def test_store_size_stays_constant(self):
+        """the store should not grow under sustained write load"""
+        registry = SnapshotRegistry(maxsize=10)
+        store = registry.get_store(self.model)
+        for pk in range(100):
+            # prepared but never consumed (e.g. the save has failed)
+            registry.prepare(self.model, MagicMock(pk=pk), self.fetch)
+        self.assertEqual(store.size, 10)
+        self.assertEqual(store.evictions, 90)
+
+    def test_consume_return_none(self):
+        """consume should return None if the snapshot is not prepared"""
+        instance = MagicMock(pk=1)
+        self.assertIsNone(self.registry.consume(self.model, instance))
+
+    def test_consume_return_snapshot_of_each_instance(self):
+        """consume should return the snapshot of each instance of a row"""
+        a = MagicMock(pk=1)
+        b = MagicMock(pk=1)
+        snapshot_a = self.registry.prepare(self.model, a, self.fetch)
+        snapshot_b = self.registry.prepare(self.model, b, self.fetch)
+        self.assertEqual(self.registry.consume(self.model, a), snapshot_a)
+        self.assertEqual(self.registry.consume(self.model, b), snapshot_b)
+
+    def test_investigate_interleaved_saves_of_a_row(self):
+        """investigate should find changes of interleaved saves of a row"""
+        investigator = Investigator(self.model, registry=self.registry)
+        article = ArticleFactory(title='original')
+        a = self.model.objects.get(pk=article.pk)
+        b = self.model.objects.get(pk=article.pk)
+        a.title = 'modified'
+        b.content = 'modified'
+        investigator.prepare(a)
+        investigator.prepare(b)
+        a.save()
+        self.assertEqual(list(investigator.investigate(a)), ['title'])
+        b.save()
+        self.assertEqual(list(investigator.investigate(b)), ['content'])
+
+
+class ObserverSnapshotRegistryCaptureOnLoadTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.registry = SnapshotRegistry()
+        self.investigator = Investigator(self.model,
+                                         include=['title'],
+                                         registry=self.registry,
+                                         snapshot_on_load=True)
+
+    def test_prepare_not_query_loaded_instance(self):
+        """prepare should not execute any query for loaded instances"""
+        pk = ArticleFactory(title='original').pk
+        article = self.model.objects.get(pk=pk)
+        article.title = 'modified'
+        with self.assertNumQueries(0):
+            self.investigator.prepare(article)
+        article.save()
+        self.assertEqual(list(self.investigator.investigate(article)),
+                         ['title'])
+
+    def test_prepare_not_query_saved_instance(self):
+        """prepare should not execute any query for saved instances"""
+        article = ArticleFactory(title='original')
+        article.title = 'modified'
+        with self.assertNumQueries(0):
+            self.investigator.prepare(article)
+        article.save()
+        self.assertEqual(list(self.investigator.investigate(article)),
+                         ['title'])
+        # the snapshot should be refreshed after save
+        with self.assertNumQueries(0):
+            self.investigator.prepare(article)
+        article.save()
+        self.assertEqual(list(self.investigator.investigate(article)), [])
+
+    def test_snapshot_refreshed_only_with_update_fields(self):
+        """the snapshot should be refreshed only with update_fields"""
+        article = ArticleFactory(title='original', content='original')
+        article.title = 'modified'
+        article.content = 'modified'
+        article.save(update_fields=['content'])
+        self.investigator.prepare(article)
+        article.save()
+        self.assertEqual(list(self.investigator.investigate(article)),
+                         ['title'])
+
+    def test_snapshot_refreshed_with_update_fields_of_attnames(self):
+        """the snapshot should be refreshed with attnames in update_fields"""
+        self.registry.register_fields(self.model, ['author'])
+        article = ArticleFactory()
+        article.author = UserFactory()
+        article.save(update_fields=['author_id'])
+        snapshot = self.registry.get_loaded(self.model, article)
+        self.assertEqual(snapshot.author_id, article.author_id)
+
+    def test_snapshot_capture_registered_fields(self):
+        """the snapshot should contain only the registered fields"""
+        article = self.model.objects.get(pk=ArticleFactory().pk)
+        snapshot = self.registry.get_loaded(self.model, article)
+        self.assertEqual(snapshot.title, article.title)
+        self.assertFalse('content' in snapshot.__dict__)
+        article.save()
+        snapshot = self.registry.get_loaded(self.model, article)
+        self.assertFalse('content' in snapshot.__dict__)
+
+    def test_get_loaded_return_none_for_lacking_fields(self):
+        """get_loaded should return None if the snapshot lacks fields"""
+        article = self.model.objects.get(pk=ArticleFactory().pk)
+        self.registry.register_fields(self.model, ['content'])
+        self.assertIsNone(self.registry.get_loaded(self.model, article))
+
+
+class ObserverSnapshotRegistryQueryTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.callback = MagicMock()
+
+    def watch(self, attr):
+        watcher = ValueWatcher(self.model, attr, self.callback)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def count_queries_of_save(self, instance):
+        with CaptureQueriesContext(connection) as context:
+            instance.save()
+        return len(context)
+
+    def test_query_count_stays_flat(self):
+        """the number of queries should not increase with watchers"""
+        article = ArticleFactory()
+        self.watch('title')
+        article.title = 'modified'
+        expected = self.count_queries_of_save(article)
+        for attr in ('title', 'content', 'supplement', 'author'):
+            self.watch(attr)
+        article.title = 'modified again'
+        self.assertEqual(self.count_queries_of_save(article), expected)
+        # all watchers of 'title' should be called
+        self.assertEqual(self.callback.call_count, 3)
@@ -0,0 +1,130 @@
+import threading
+from observer.tests.compat import TestCase
+from observer.tests.compat import MagicMock, patch
+from observer.tests.models import Article, Project
+from observer.tests.factories import ArticleFactory
+from observer.investigator import Investigator
+from observer.watchers.value import ValueWatcher
+from observer.watchers.related import RelatedWatcher, ManyRelatedWatcher
+from observer.suspension import suspend, resume, is_suspended
+from observer.dispatcher import Dispatcher
+from observer.query import ObserverQuerySet
+
+
+class ObserverSuspensionTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'title'
+        self.callback = MagicMock()
+        self.article = ArticleFactory()
+
+    def watch(self, callback=None):
+        watcher = ValueWatcher(self.model, self.attr,
+                               callback or self.callback,
+                               call_on_created=False)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def modify(self):
+        self.article.title = 'modified'
+        self.article.save()
+
+    def test_suspend_all(self):
+        """callback should not be called while all watchers are suspended"""
+        self.watch()
+        with suspend():
+            self.modify()
+        self.assertFalse(self.callback.called)
+
+    def test_suspend_model(self):
+        """callback should not be called while the model is suspended"""
+        self.watch()
+        with suspend(self.model):
+            self.modify()
+        self.assertFalse(self.callback.called)
+        with suspend(Project):
+            self.modify()
+        self.assertFalse(self.callback.called)
+
+    def test_suspend_watcher(self):
+        """only the suspended watcher should not be called"""
+        watcher = self.watch()
+        callback = MagicMock()
+        self.watch(callback)
+        with watcher.suspend():
+            self.modify()
+        self.assertFalse(self.callback.called)
+        self.assertTrue(callback.called)
+
+    def test_suspend_decorator(self):
+        """suspend should be used as a decorator"""
+        self.watch()
+        suspend()(self.modify)()
+        self.assertFalse(self.callback.called)
+        self.assertFalse(is_suspended(self.model))
+
+    def test_resume(self):
+        """callback should be called when the watcher is resumed"""
+        watcher = self.watch()
+        with suspend(watcher):
+            with resume(watcher):
+                self.modify()
+            self.assertTrue(is_suspended(watcher))
+        self.assertEqual(self.callback.call_count, 1)
+
+    def test_snapshot_not_fetched(self):
+        """snapshots should not be fetched while the watchers are suspended"""
+        self.watch()
+        with patch.object(Investigator, 'prepare') as prepare:
+            with suspend(self.model):
+                self.modify()
+            self.assertFalse(prepare.called)
+
+    def test_update_not_captured(self):
+        """QuerySet.update should not capture while suspended"""
+        self.watch()
+        queryset = ObserverQuerySet(self.model)
+        with patch.object(Dispatcher, 'capture') as capture:
+            with patch.object(Dispatcher, 'dispatch_updated') as dispatch:
+                with suspend(self.model):
+                    with self.assertNumQueries(1):
+                        queryset.update(title='modified')
+                self.assertFalse(capture.called)
+                self.assertFalse(dispatch.called)
+        self.assertFalse(self.callback.called)
+
+    def test_snapshot_not_fetched_for_related_watcher(self):
+        """snapshots should not be fetched for suspended related watchers"""
+        watcher = RelatedWatcher(self.model, 'author', self.callback,
+                                 call_on_created=False)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        with patch.object(Investigator, 'prepare') as prepare:
+            with watcher.suspend():
+                self.modify()
+            self.assertFalse(prepare.called)
+        self.assertFalse(self.callback.called)
+
+    def test_related_objects_not_fetched(self):
+        """related objects should not be fetched for suspended watchers"""
+        watcher = ManyRelatedWatcher(self.model, 'collaborators',
+                                     self.callback, call_on_created=False,
+                                     pass_diff=True)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        with patch.object(watcher, 'get_related_pks') as get_related_pks:
+            with watcher.suspend():
+                self.article.collaborators.clear()
+            self.assertFalse(get_related_pks.called)
+        self.assertFalse(self.callback.called)
+
+    def test_suspend_thread_local(self):
+        """suspend should not affect the other threads"""
+        self.watch()
+        with suspend():
+            thread = threading.Thread(target=lambda: is_suspended(
+                self.model) or self.callback())
+            thread.start()
+            thread.join()
+        self.assertTrue(self.callback.called)
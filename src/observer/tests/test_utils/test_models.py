@@ -3,8 +3,15 @@ from django.db.models import FieldDoesNotExist
 from django.contrib.contenttypes.generic import (GenericRelation,
                                                  GenericForeignKey)
 from observer.tests.compat import TestCase
+from django.db.models.signals import class_prepared
+from observer.tests.compat import patch
 from observer.utils.models import get_field
-from observer.tests.models import Article, Tag
+from observer.utils.models import _field_indexes
+from django.contrib.contenttypes.models import ContentType
+from observer.utils.models import iter_pk_chunks
+from observer.utils.models import resolve_generic_objects
+from observer.tests.models import Article, Tag, User
+from observer.tests.factories import ArticleFactory, UserFactory
 
 
 class ObserverUtilsModelsGetFieldTestCase(TestCase):
@@ -57,3 +64,76 @@ class ObserverUtilsModelsGetFieldTestCase(TestCase):
             self.assertTrue(isinstance(field, expect))
             # field's model is equal
             self.assertEqual(field.model, model)
+
+
+class ObserverUtilsModelsIterPkChunksTestCase(TestCase):
+    def setUp(self):
+        self.pks = [ArticleFactory().pk for i in range(5)]
+
+    def test_iter_pk_chunks(self):
+        """iter_pk_chunks should yield primary keys in chunks"""
+        r = list(iter_pk_chunks(Article.objects.all(), 2))
+        self.assertEqual(r, [self.pks[0:2], self.pks[2:4], self.pks[4:]])
+
+    def test_iter_pk_chunks_query_per_chunk(self):
+        """iter_pk_chunks should execute a query per chunk"""
+        with self.assertNumQueries(3):
+            list(iter_pk_chunks(Article.objects.all(), 2))
+
+    def test_iter_pk_chunks_empty(self):
+        """iter_pk_chunks should yield nothing for an empty queryset"""
+        r = list(iter_pk_chunks(Article.objects.none(), 2))
+        self.assertEqual(r, [])
+
+
+class ObserverUtilsModelsResolveGenericObjectsTestCase(TestCase):
+    def setUp(self):
+        self.articles = [ArticleFactory() for i in range(3)]
+        self.users = [UserFactory() for i in range(3)]
+        self.article_ct = ContentType.objects.get_for_model(Article)
+        self.user_ct = ContentType.objects.get_for_model(User)
+        self.refs = [(self.article_ct.pk, x.pk) for x in self.articles]
+        self.refs += [(self.user_ct.pk, x.pk) for x in self.users]
+
+    def test_resolve_generic_objects(self):
+        """resolve_generic_objects should return the objects of refs"""
+        r = resolve_generic_objects(self.refs)
+        self.assertEqual(r, dict(zip(self.refs, self.articles + self.users)))
+
+    def test_resolve_generic_objects_query_per_content_type(self):
+        """resolve_generic_objects should execute a query per content type"""
+        with self.assertNumQueries(2):
+            resolve_generic_objects(self.refs)
+
+    def test_resolve_generic_objects_ignore_missing(self):
+        """resolve_generic_objects should ignore missing objects"""
+        r = resolve_generic_objects([(self.article_ct.pk, -1),
+                                     (None, None)])
+        self.assertEqual(r, {})
+
+
+class ObserverUtilsModelsGetFieldIndexTestCase(TestCase):
+    def setUp(self):
+        self.model = Article
+        # make sure that the index is not built yet
+        _field_indexes.clear()
+
+    def test_get_field_not_iterate_fields_twice(self):
+        """get_field should not iterate related objects twice"""
+        meta = self.model._meta
+        with patch.object(meta, 'get_all_related_objects',
+                          wraps=meta.get_all_related_objects) as m:
+            get_field(self.model, 'projects')
+            get_field(self.model, 'revision')
+            get_field(self.model, 'hyperlinks')
+        self.assertEqual(m.call_count, 1)
+
+    def test_get_field_index_invalidated_on_class_prepared(self):
+        """the index should be invalidated when a new model is prepared"""
+        meta = self.model._meta
+        with patch.object(meta, 'get_all_related_objects',
+                          wraps=meta.get_all_related_objects) as m:
+            get_field(self.model, 'projects')
+            class_prepared.send(sender=self.model)
+            get_field(self.model, 'projects')
+        self.assertEqual(m.call_count, 2)
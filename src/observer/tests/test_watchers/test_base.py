@@ -31,6 +31,16 @@ class ObserverWatchersWatcherBaseTestCase(TestCase):
         self.callback.assert_called_once_with(
             sender=self.watcher, obj=obj, attr=self.attr)
 
+    def test_call_call_callback_with_changes(self):
+        """call should call callback with changes if pass_changes"""
+        watcher = WatcherBase(self.model, self.attr, self.callback,
+                              pass_changes=True)
+        obj = MagicMock()
+        changes = MagicMock()
+        watcher.call(obj, changes)
+        self.callback.assert_called_once_with(
+            sender=watcher, obj=obj, attr=self.attr, changes=changes)
+
     def test_get_field_return_field(self):
         """get_field should return field instance"""
         self.assertTrue(isinstance(self.watcher.get_field(),
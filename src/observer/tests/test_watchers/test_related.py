@@ -1,7 +1,10 @@
 from django.core.exceptions import ObjectDoesNotExist
 from observer.tests.compat import TestCase
 from observer.tests.compat import MagicMock, skip
-from observer.tests.models import Article, Tag
+from observer.tests.compat import override_settings
+from observer.tests.compat import NON_BULK
+from django.contrib.contenttypes.models import ContentType
+from observer.tests.models import Article, Project, Tag
 from observer.tests.factories import (ArticleFactory,
                                       SupplementFactory,
                                       RevisionFactory,
@@ -9,6 +12,8 @@ from observer.tests.factories import (ArticleFactory,
                                       ProjectFactory,
                                       HyperlinkFactory,
                                       TagFactory)
+from observer.investigator import RelationDiff
+from observer.dispatcher import collect_deleted
 from observer.watchers.related import (RelatedWatcherBase,
                                        RelatedWatcher,
                                        ManyRelatedWatcher,
@@ -475,7 +480,7 @@ class ObserverWatchersManyRelatedWatcherTestCaseRevManyToOneRel(TestCase):
     def test_callback_called_on_remove_with_watch(self):
         new_instance = ArticleFactory(projects=self.projects)
         self.watcher.watch()
-        new_instance.projects.remove(self.projects[0])
+        new_instance.projects.remove(self.projects[0], **NON_BULK)
         # callback should be called with instance modification
         self.callback.assert_called_once_with(
             obj=new_instance, attr=self.attr, sender=self.watcher)
@@ -998,3 +1003,429 @@ class ObserverWatchersGenericRelatedWatcherTestCaseRev(TestCase):
         # callback should be called with instance modification
         self.callback.assert_called_once_with(
             obj=new_instance, attr=self.attr, sender=self.watcher)
+
+
+# ============================================================================
+# Batch
+# ============================================================================
+class ObserverWatchersRelatedWatcherBaseTestCaseBatch(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'author'
+        self.callback = MagicMock()
+        self.watcher = RelatedWatcherBase(self.model,
+                                          self.attr,
+                                          self.callback,
+                                          batch=True)
+        self.addCleanup(self.watcher.unwatch)
+
+    def test_callback_called_once_with_objs(self):
+        """callback should be called once with all the affected objects"""
+        author = UserFactory()
+        articles = [ArticleFactory(author=author) for i in range(3)]
+        self.watcher.watch()
+        author.label = 'modified'
+        author.save()
+        self.assertEqual(self.callback.call_count, 1)
+        kwargs = self.callback.call_args[1]
+        self.assertEqual(set(kwargs['objs']), set(articles))
+        self.assertEqual(kwargs['attr'], self.attr)
+        self.assertEqual(kwargs['sender'], self.watcher)
+        # the queryset should be evaluated before it is dispatched
+        self.assertTrue(isinstance(kwargs['objs'], list))
+
+    def test_callback_not_called_without_affected_objects(self):
+        """callback should not be called with an empty batch"""
+        author = UserFactory()
+        self.watcher.watch()
+        author.label = 'modified'
+        author.save()
+        self.assertFalse(self.callback.called)
+
+    def test_callback_called_with_created_object(self):
+        """callback should be called with a list of the created object"""
+        self.watcher.watch()
+        new_instance = ArticleFactory()
+        self.callback.assert_called_once_with(
+            objs=[new_instance], attr=self.attr, sender=self.watcher)
+
+
+class ObserverWatchersManyRelatedWatcherTestCaseBatch(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'collaborators'
+        self.callback = MagicMock()
+        self.watcher = ManyRelatedWatcher(self.model,
+                                          self.attr,
+                                          self.callback,
+                                          call_on_created=False,
+                                          batch=True)
+        self.addCleanup(self.watcher.unwatch)
+
+    def test_callback_called_once_with_objs(self):
+        """callback should be called once with all the affected objects"""
+        user = UserFactory()
+        articles = [ArticleFactory() for i in range(3)]
+        self.watcher.watch()
+        user.articles.add(*articles)
+        self.assertEqual(self.callback.call_count, 1)
+        kwargs = self.callback.call_args[1]
+        self.assertEqual(set(kwargs['objs']), set(articles))
+
+
+# ============================================================================
+# Chunked fan-out
+# ============================================================================
+class ObserverWatchersRelatedWatcherBaseTestCaseChunk(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'author'
+        self.callback = MagicMock()
+        self.author = UserFactory()
+        self.articles = [ArticleFactory(author=self.author)
+                         for i in range(5)]
+
+    def watch(self, **kwargs):
+        watcher = RelatedWatcherBase(self.model, self.attr, self.callback,
+                                     chunk_size=2, **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_callback_called_per_object(self):
+        """callback should be called for each object of the chunks"""
+        self.watch()
+        self.author.label = 'modified'
+        self.author.save()
+        objs = [x[1]['obj'] for x in self.callback.call_args_list]
+        self.assertEqual(sorted(x.pk for x in objs),
+                         sorted(x.pk for x in self.articles))
+
+    def test_batch_callback_called_per_chunk(self):
+        """batch callback should be called for each chunk"""
+        self.watch(batch=True)
+        self.author.label = 'modified'
+        self.author.save()
+        chunks = [list(x[1]['objs']) for x in self.callback.call_args_list]
+        self.assertEqual([len(x) for x in chunks], [2, 2, 1])
+        self.assertEqual(set(sum(chunks, [])), set(self.articles))
+
+
+# ============================================================================
+# Relation diff
+# ============================================================================
+class ObserverWatchersRelatedWatcherTestCaseRelationDiff(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.callback = MagicMock()
+
+    def watch(self, Watcher, attr):
+        watcher = Watcher(self.model, attr, self.callback,
+                          call_on_created=False, pass_diff=True)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def get_diffs(self):
+        return dict((x[1]['obj'], x[1]['diff'])
+                    for x in self.callback.call_args_list)
+
+    def test_diff_of_reverse_foreign_key(self):
+        """callback should be called with added and removed pks"""
+        a1 = ArticleFactory()
+        a2 = ArticleFactory()
+        project = ProjectFactory(article=a1)
+        self.watch(RelatedWatcherBase, 'projects')
+        project.article = a2
+        project.save()
+        self.assertEqual(self.get_diffs(), {
+            a1: RelationDiff.create(removed=[project.pk]),
+            a2: RelationDiff.create(added=[project.pk]),
+        })
+
+    def test_diff_of_unchanged_reverse_foreign_key(self):
+        """callback should be called with unchanged pks"""
+        a1 = ArticleFactory()
+        project = ProjectFactory(article=a1)
+        self.watch(RelatedWatcherBase, 'projects')
+        project.label = 'modified'
+        project.save()
+        self.assertEqual(self.get_diffs(), {
+            a1: RelationDiff.create(unchanged=[project.pk]),
+        })
+
+    def test_diff_of_reverse_foreign_key_from_columns(self):
+        """the diff should be built from the columns without queries"""
+        a1 = ArticleFactory()
+        a2 = ArticleFactory()
+        project = ProjectFactory(article=a1)
+        snapshot = Project.objects.get(pk=project.pk)
+        project = Project.objects.get(pk=project.pk)
+        project.article_id = a2.pk
+        watcher = RelatedWatcherBase(self.model, 'projects', self.callback,
+                                     call_on_created=False, batch=True,
+                                     pass_diff=True, pks_only=True)
+        with self.assertNumQueries(0):
+            watcher._changed_receiver(project, [], snapshot)
+        self.assertEqual(self.callback.call_count, 2)
+        watcher = RelatedWatcherBase(self.model, 'projects', self.callback,
+                                     call_on_created=False, batch=True,
+                                     pass_diff=True)
+        self.callback.reset_mock()
+        with self.assertNumQueries(1):
+            watcher._changed_receiver(project, [], snapshot)
+        self.assertEqual(sorted(x[1]['objs'][0].pk
+                                for x in self.callback.call_args_list),
+                         sorted([a1.pk, a2.pk]))
+
+    def test_diff_of_foreign_key(self):
+        """callback should be called with the old and new pks"""
+        article = ArticleFactory()
+        old_author = article.author
+        new_author = UserFactory()
+        self.watch(RelatedWatcher, 'author')
+        article.author = new_author
+        article.save()
+        self.assertEqual(self.get_diffs(), {
+            article: RelationDiff.create(added=[new_author.pk],
+                                         removed=[old_author.pk]),
+        })
+
+    def test_diff_of_many_to_many(self):
+        """callback should be called with the pk_set of m2m changes"""
+        article = ArticleFactory()
+        users = [UserFactory() for i in range(2)]
+        self.watch(ManyRelatedWatcher, 'collaborators')
+        article.collaborators.add(*users)
+        self.assertEqual(self.get_diffs(), {
+            article: RelationDiff.create(added=[x.pk for x in users]),
+        })
+        self.callback.reset_mock()
+        article.collaborators.remove(users[0])
+        self.assertEqual(self.get_diffs(), {
+            article: RelationDiff.create(removed=[users[0].pk]),
+        })
+
+    def test_diff_of_reverse_many_to_many(self):
+        """callback should be called with the pk of the instance"""
+        user = UserFactory()
+        articles = [ArticleFactory() for i in range(2)]
+        self.watch(ManyRelatedWatcher, 'collaborators')
+        user.articles.add(*articles)
+        self.assertEqual(self.get_diffs(), dict(
+            (x, RelationDiff.create(added=[user.pk])) for x in articles
+        ))
+
+    def test_diff_of_many_to_many_clear(self):
+        """callback should be called with the cleared pks"""
+        users = [UserFactory() for i in range(2)]
+        article = ArticleFactory(collaborators=users)
+        self.watch(ManyRelatedWatcher, 'collaborators')
+        article.collaborators.clear()
+        self.assertEqual(self.get_diffs(), {
+            article: RelationDiff.create(removed=[x.pk for x in users]),
+        })
+
+
+# ============================================================================
+# Clear
+# ============================================================================
+class ObserverWatchersManyRelatedWatcherTestCaseClear(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'collaborators'
+        self.callback = MagicMock()
+        self.user = UserFactory()
+        self.articles = [ArticleFactory(collaborators=[self.user])
+                         for i in range(5)]
+
+    def watch(self, **kwargs):
+        watcher = ManyRelatedWatcher(self.model, self.attr, self.callback,
+                                     call_on_created=False, **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_callback_called_on_reverse_clear(self):
+        """callback should be called for each cleared object"""
+        self.watch()
+        self.user.articles.clear()
+        objs = [x[1]['obj'] for x in self.callback.call_args_list]
+        self.assertEqual(sorted(x.pk for x in objs),
+                         sorted(x.pk for x in self.articles))
+
+    def test_callback_called_on_reverse_clear_in_chunks(self):
+        """batch callback should be called for each chunk of cleared objects"""
+        self.watch(batch=True, chunk_size=2)
+        self.user.articles.clear()
+        chunks = [list(x[1]['objs']) for x in self.callback.call_args_list]
+        self.assertEqual([len(x) for x in chunks], [2, 2, 1])
+        self.assertEqual(set(sum(chunks, [])), set(self.articles))
+
+    def test_callback_called_on_clear(self):
+        """callback should be called for the cleared object"""
+        watcher = self.watch()
+        article = self.articles[0]
+        article.collaborators.clear()
+        self.callback.assert_called_once_with(
+            obj=article, attr=self.attr, sender=watcher)
+
+
+# ============================================================================
+# Chunked m2m fan-out
+# ============================================================================
+class ObserverWatchersManyRelatedWatcherTestCaseChunk(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'collaborators'
+        self.callback = MagicMock()
+        self.user = UserFactory()
+        self.articles = [ArticleFactory() for i in range(5)]
+
+    def watch(self, **kwargs):
+        watcher = ManyRelatedWatcher(self.model, self.attr, self.callback,
+                                     call_on_created=False, batch=True,
+                                     **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_pks_only_raise_exception_without_batch(self):
+        """pks_only should not be used without batch"""
+        self.assertRaises(ValueError, ManyRelatedWatcher,
+                          self.model, self.attr, self.callback,
+                          pks_only=True)
+
+    def test_callback_called_with_pks_in_chunks(self):
+        """batch callback should be called with pks per chunk"""
+        watcher = self.watch(chunk_size=2, pks_only=True)
+        self.user.articles.add(*self.articles)
+        chunks = [x[1]['pks'] for x in self.callback.call_args_list]
+        self.assertEqual([len(x) for x in chunks], [2, 2, 1])
+        self.assertEqual(set(sum(chunks, [])),
+                         set(x.pk for x in self.articles))
+        stats = watcher.stats()
+        self.assertEqual(stats['chunks'], 3)
+        self.assertEqual(stats['objects'], 5)
+
+    @override_settings(OBSERVER_IN_BULK_CHUNK_SIZE=2)
+    def test_callback_called_with_objs_in_chunks(self):
+        """batch callback should be called with objects per chunk"""
+        self.watch()
+        self.user.articles.add(*self.articles)
+        chunks = [x[1]['objs'] for x in self.callback.call_args_list]
+        self.assertEqual([len(x) for x in chunks], [2, 2, 1])
+        self.assertEqual(set(sum(chunks, [])), set(self.articles))
+
+
+# ============================================================================
+# Generic resolution
+# ============================================================================
+class ObserverWatchersGenericRelatedWatcherTestCaseResolution(TestCase):
+    def setUp(self):
+        self.model = Article
+        self.attr = 'tags'
+        self.callback = MagicMock()
+        self.watcher = GenericRelatedWatcher(self.model,
+                                             self.attr,
+                                             self.callback)
+        self.articles = [ArticleFactory() for i in range(2)]
+        self.tag = TagFactory(content_object=self.articles[0])
+        # warm up the content type cache
+        ContentType.objects.get_for_model(Article)
+
+    def test_get_values_pair_resolve_in_bulk(self):
+        """get_values_pair should resolve the objects with a query"""
+        snapshot = Tag.objects.get(pk=self.tag.pk)
+        instance = Tag.objects.get(pk=self.tag.pk)
+        instance.object_id = self.articles[1].pk
+        with self.assertNumQueries(1):
+            r = self.watcher.get_values_pair(snapshot, instance)
+        self.assertEqual(r, (set([self.articles[0]]),
+                             set([self.articles[1]])))
+
+    def test_get_value_use_loaded_object(self):
+        """get_value should use the loaded object without queries"""
+        instance = Tag.objects.get(pk=self.tag.pk)
+        instance.content_object
+        with self.assertNumQueries(0):
+            r = self.watcher.get_value(instance)
+        self.assertEqual(r, self.articles[0])
+
+
+# ============================================================================
+# Delete
+# ============================================================================
+class ObserverWatchersRelatedWatcherTestCaseDelete(TestCase):
+    def setUp(self):
+        self.callback = MagicMock()
+        self.projects = [ProjectFactory() for i in range(3)]
+        self.article = ArticleFactory(projects=self.projects)
+
+    def watch(self, cls, attr, **kwargs):
+        kwargs.setdefault('call_on_deleted', True)
+        watcher = cls(Article, attr, self.callback,
+                      call_on_created=False, batch=True, pass_diff=True,
+                      **kwargs)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        return watcher
+
+    def test_callback_called_on_delete(self):
+        """callback should be called when a related object is deleted"""
+        watcher = self.watch(ManyRelatedWatcher, 'projects')
+        pk = self.projects[0].pk
+        self.projects[0].delete()
+        self.callback.assert_called_once_with(
+            objs=[self.article], attr='projects', sender=watcher,
+            diff=RelationDiff.create(removed=[pk]))
+
+    def test_callback_not_called_without_call_on_deleted(self):
+        """callback should not be called without call_on_deleted"""
+        self.watch(ManyRelatedWatcher, 'projects', call_on_deleted=False)
+        self.projects[0].delete()
+        self.assertFalse(self.callback.called)
+
+    def test_get_deleted_pairs_without_query(self):
+        """get_deleted_pairs should not query for the foreign key"""
+        watcher = self.watch(ManyRelatedWatcher, 'projects')
+        with self.assertNumQueries(0):
+            r = watcher.get_deleted_pairs(self.projects[0])
+        self.assertEqual(r, [(self.projects[0].pk, self.article.pk)])
+
+    def test_callback_called_on_forward_delete(self):
+        """callback should be called when a referenced object is deleted"""
+        watcher = self.watch(ManyRelatedWatcher, 'collaborators')
+        user = UserFactory()
+        self.article.collaborators.add(user)
+        self.callback.reset_mock()
+        pk = user.pk
+        user.delete()
+        self.callback.assert_called_once_with(
+            objs=[self.article], attr='collaborators', sender=watcher,
+            diff=RelationDiff.create(removed=[pk]))
+
+    def test_callback_called_on_generic_delete(self):
+        """callback should be called when a generic object is deleted"""
+        watcher = self.watch(GenericRelatedWatcher, 'tags')
+        tag = TagFactory(content_object=self.article)
+        pk = tag.pk
+        tag.delete()
+        self.callback.assert_called_once_with(
+            objs=[self.article], attr='tags', sender=watcher,
+            diff=RelationDiff.create(removed=[pk]))
+
+    def test_callback_not_called_with_deleted_objects(self):
+        """callback should not be called with the cascade deleted objects"""
+        self.watch(ManyRelatedWatcher, 'projects')
+        with collect_deleted():
+            self.article.delete()
+        self.assertFalse(self.callback.called)
+
+    def test_callback_called_once_in_collect_deleted(self):
+        """callback should be called once in collect_deleted"""
+        self.watch(ManyRelatedWatcher, 'projects')
+        with collect_deleted():
+            for project in self.projects:
+                project.delete()
+        self.assertEqual(self.callback.call_count, 1)
@@ -3,6 +3,7 @@ from observer.tests.compat import MagicMock
 from observer.tests.models import Article
 from observer.tests.factories import ArticleFactory
 from observer.watchers.value import ValueWatcher
+from observer.investigator import Change
 
 
 class ObserverWatchersValueWatcherTestCase(TestCase):
@@ -56,3 +57,37 @@ class ObserverWatchersValueWatcherTestCase(TestCase):
         new_instance.save()
         # content is not watched thus callback should not be called
         self.assertFalse(self.callback.called)
+
+    def test_callback_called_with_changes_with_pass_changes(self):
+        watcher = ValueWatcher(self.model, self.attr, self.callback,
+                               pass_changes=True)
+        watcher.watch()
+        self.addCleanup(watcher.unwatch)
+        new_instance = ArticleFactory(title='original')
+        self.callback.assert_called_once_with(
+            obj=new_instance, attr=self.attr, sender=watcher,
+            changes=None)
+        new_instance.title = 'modified'
+        new_instance.save()
+        # callback should be called with the change record
+        self.callback.assert_called_with(
+            obj=new_instance, attr=self.attr, sender=watcher,
+            changes=[Change('title', 'original', 'modified')])
+
+    def test_callback_not_called_with_non_interest_update_fields(self):
+        new_instance = ArticleFactory()
+        self.watcher.watch()
+        new_instance.title = 'modified'
+        new_instance.content = 'modified'
+        with self.assertNumQueries(1):
+            # only UPDATE query should be executed
+            new_instance.save(update_fields=['content'])
+        self.assertFalse(self.callback.called)
+
+    def test_callback_called_with_interest_update_fields(self):
+        new_instance = ArticleFactory()
+        self.watcher.watch()
+        new_instance.title = 'modified'
+        new_instance.save(update_fields=['title'])
+        self.callback.assert_called_once_with(
+            obj=new_instance, attr=self.attr, sender=self.watcher)
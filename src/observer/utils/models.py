@@ -1,5 +1,43 @@
-from django.db.models.loading import get_model
 from django.db.models.fields import FieldDoesNotExist
+from observer.compat import get_model
+
+
+# model options -> {attr: field}
+_field_indexes = {}
+
+
+def get_field_index(model):
+    """
+    Get a dictionary of attribute names and Field instances of the model
+
+    The dictionary contains concrete fields, many to many fields, reverse
+    relations, reverse many to many relations and virtual fields. It is
+    built once per model and invalidated when a new model class is prepared
+    (it may add reverse relations).
+
+    Args:
+        model (model): A model or model instance
+
+    Returns:
+        dict
+    """
+    meta = model._meta
+    index = _field_indexes.get(meta)
+    if index is None:
+        index = {}
+        # the former has the priority thus update in the reverse order
+        for field in meta.virtual_fields:
+            index[field.name] = field
+        for robj in meta.get_all_related_many_to_many_objects():
+            # notice that the field belongs to related object
+            index[robj.get_accessor_name()] = robj.field
+        for robj in meta.get_all_related_objects():
+            # notice that the field belongs to related object
+            index[robj.get_accessor_name()] = robj.field
+        for field in list(meta.fields) + list(meta.many_to_many):
+            index[field.name] = field
+        _field_indexes[meta] = index
+    return index
 
 
 def get_field(model, attr, ignore_exception=True):
@@ -10,11 +48,8 @@ def get_field(model, attr, ignore_exception=True):
     not refer reverse relations, many to many relations, and vritual
     fields.
 
-    Notice that this function iterate all fields to find the corresponding
-    field instance. This may cause a performance issue thus you should use
-    your own cache system to store the found instance.
-    If you are using Python 3.2 or above, you might interested in
-    a `functools.lru_cache` or `pylru.lrudecorator` to memoizing the result
+    The field is found from the index of the model (`get_field_index`) thus
+    it does not iterate the fields.
 
     Args:
         model (model): A model or model instance
@@ -29,34 +64,78 @@ def get_field(model, attr, ignore_exception=True):
     Returns:
         None or an instance of Field.
     """
-    meta = model._meta
-    # try to find with get_field
-    try:
-        return meta.get_field(attr)
-    except FieldDoesNotExist:
-        # reverse relations and virtual fields could not be found
-        # with `get_field` thus just ignore it.
-        pass
-    # from reverse relations of ForeignKey/OneToOneField
-    for robj in meta.get_all_related_objects():
-        if attr == robj.get_accessor_name():
-            # notice that the field belongs to related object
-            return robj.field
-    # from reverse relations of ManyToMany
-    for robj in meta.get_all_related_many_to_many_objects():
-        if attr == robj.get_accessor_name():
-            # notice that the field belongs to related object
-            return robj.field
-    # from virtual fields
-    for field in meta.virtual_fields:
-        if field.name == attr:
-            return field
+    field = get_field_index(model).get(attr)
+    if field is not None:
+        return field
     # could not be found
     if ignore_exception:
         return None
     raise FieldDoesNotExist
 
 
+def iter_pk_chunks(queryset, chunk_size):
+    """
+    Iterate the primary keys of the queryset in chunks
+
+    Only the primary keys are fetched and the chunks are paginated with the
+    last primary key of the previous chunk (keyset pagination) thus each
+    query is cheap even for huge querysets and the memory usage is bounded
+    by the chunk size.
+
+    Args:
+        queryset (queryset): A queryset
+        chunk_size (int): The maximum number of primary keys in a chunk
+
+    Returns:
+        A generator of primary key lists
+    """
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if pks:
+            yield pks
+        if len(pks) < chunk_size:
+            return
+        last = pks[-1]
+
+
+def resolve_generic_objects(refs):
+    """
+    Resolve generic references to objects
+
+    The content types are resolved from the in-process cache of ContentType
+    manager and the objects are fetched with an `in_bulk` query per content
+    type thus the number of queries does not depend on the number of the
+    references.
+
+    Args:
+        refs (iterable): (content type id, object id) pairs
+
+    Returns:
+        A dictionary of (content type id, object id) and the object. The
+        references which could not be resolved are not included.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    groups = {}
+    for ct_id, object_id in refs:
+        if ct_id is None or object_id is None:
+            continue
+        groups.setdefault(ct_id, set()).add(object_id)
+    objects = {}
+    for ct_id, object_ids in groups.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is None:
+            # the model is not installed
+            continue
+        to_python = model._meta.pk.to_python
+        pks = dict((to_python(x), x) for x in object_ids)
+        for pk, obj in model._default_manager.in_bulk(list(pks)).items():
+            objects[(ct_id, pks[pk])] = obj
+    return objects
+
+
 def get_relation(relation):
     """
     Resolve relation
@@ -78,7 +157,7 @@ def get_relation(relation):
     except AttributeError:
         app_label = relation._meta.app_label
         model_name = relation._meta.model_name
-    model = get_model(app_label, model_name, False)
+    model = get_model(app_label, model_name)
     return model, app_label, model_name
 
 
@@ -113,5 +192,11 @@ def _do_pending_lookups(sender, **kwargs):
         operation(sender, **kwargs)
 
 
+def _clear_field_indexes(sender, **kwargs):
+    # a new model may add reverse relations to the indexed models
+    _field_indexes.clear()
+
+
 from django.db.models.signals import class_prepared
 class_prepared.connect(_do_pending_lookups)
+class_prepared.connect(_clear_field_indexes)
@@ -1,5 +1,7 @@
-from observer.conf import settings
-from observer.compat import lru_cache
+from observer.compat import iscoroutinefunction
+from observer.backends import get_backend
+from observer.suspension import suspend
+from observer.suspension import is_watcher_suspended
 from observer.utils.models import get_field
 from observer.utils.models import resolve_relation_lazy
 
@@ -18,18 +20,44 @@ class WatcherBase(object):
     A base watcher field class. Subclass must override `watch` and `unwatch`
     methods.
     """
-    def __init__(self, model, attr, callback):
+    def __init__(self, model, attr, callback, pass_changes=False,
+                 backend=None, batch=False, pass_diff=False):
         """
         Construct watcher field
 
         Args:
             model (model or string): A target model class or app_label.Model
             attr (str): A name of attribute
-            callback (fn): A callback function
+            callback (fn): A callback function or an asyncio coroutine
+                function
+            pass_changes (bool): Call the callback with `changes`, a list of
+                `observer.investigator.Change` records (or None when it is
+                unknown, e.g. on creation)
+            backend (None, str, backend): A dispatch backend instance or a
+                dotted path of a backend class which calls the callback.
+                `OBSERVER_DISPATCH_BACKEND` is used if it is not specified
+                (`AsyncioBackend` for coroutine function callbacks)
+            batch (bool): Call the callback once with `objs`, a list of the
+                affected object instances, instead of calling it with `obj`
+                per object instance
+            pass_diff (bool): Call the callback with `diff`, a
+                `observer.investigator.RelationDiff` record of the primary
+                keys of the related objects (or None when it is unknown)
         """
         self._model = model
         self._attr = attr
         self._callback = callback
+        self._pass_changes = pass_changes
+        self._backend = backend
+        self._batch = batch
+        self._pass_diff = pass_diff
+        # construct the backend now thus a misconfigured backend (e.g.
+        # OnCommitBackend without commit hooks) fails on startup rather than
+        # in the first save
+        get_backend(backend)
+        # a watcher which owns this watcher (the suspension of the owner
+        # suspends this watcher)
+        self.owner = None
 
         # resolve string model specification
         if not is_relation_ready(model):
@@ -49,6 +77,17 @@ class WatcherBase(object):
     def callback(self):
         return self._callback
 
+    @property
+    def batch(self):
+        return self._batch
+
+    @property
+    def backend(self):
+        if self._backend is None and iscoroutinefunction(self.callback):
+            # coroutine function callbacks must be run in an event loop
+            return get_backend('observer.backends.AsyncioBackend')
+        return get_backend(self._backend)
+
     def lazy_watch(self, **kwargs):
         """
         Call watch safely. It wait until everything get ready.
@@ -83,19 +122,109 @@ class WatcherBase(object):
         """
         raise NotImplementedError
 
-    def call(self, obj):
+    def suspend(self):
+        """
+        Return a context manager (or a decorator) which suspends the watcher
+        without disconnecting the receivers
+        """
+        return suspend(self)
+
+    def is_suspended(self):
+        """
+        Return True if the watcher is suspended
         """
-        Call the registered callback function with latest object
+        return is_watcher_suspended(self)
+
+    def call(self, obj, changes=None, diff=None):
+        """
+        Call the registered callback function with latest object through the
+        dispatch backend
 
         Args:
             obj (obj): An object instance
+            changes (None, list): A list of `Change` records. It is passed
+                to the callback only when `pass_changes` is specified
+            diff (None, RelationDiff): A `RelationDiff` record. It is passed
+                to the callback only when `pass_diff` is specified
+        """
+        if self.is_suspended():
+            return
+        if self._batch:
+            self.backend.dispatch_many(self, [obj], changes, diff)
+        else:
+            self.backend.dispatch(self, obj, changes, diff)
+
+    def call_many(self, objs, changes=None, diff=None):
+        """
+        Call the registered callback function with latest objects through
+        the dispatch backend. The callback is called once when `batch` is
+        specified, otherwise it is called per object
+
+        Args:
+            objs (iterable): Object instances. A queryset is evaluated
+                before it is dispatched thus the backends never receive
+                unevaluated querysets and empty batches are skipped
+            changes (None, list): A list of `Change` records. It is passed
+                to the callback only when `pass_changes` is specified
+            diff (None, RelationDiff): A `RelationDiff` record shared by the
+                objects. It is passed to the callback only when `pass_diff`
+                is specified
+        """
+        if self.is_suspended():
+            return
+        if self._batch:
+            objs = list(objs)
+            if objs:
+                self.backend.dispatch_many(self, objs, changes, diff)
+        else:
+            for obj in objs:
+                self.backend.dispatch(self, obj, changes, diff)
+
+    def get_callback_kwargs(self, changes=None, diff=None, **kwargs):
+        kwargs.update(sender=self, attr=self.attr)
+        if self._pass_changes:
+            kwargs['changes'] = changes
+        if self._pass_diff:
+            kwargs['diff'] = diff
+        return kwargs
+
+    def invoke(self, obj, changes=None, diff=None):
+        """
+        Call the registered callback function immediately. It is called from
+        the dispatch backend
+
+        Args:
+            obj (obj): An object instance
+            changes (None, list): A list of `Change` records
+            diff (None, RelationDiff): A `RelationDiff` record
+
+        Returns:
+            The return value of the callback (a coroutine object for
+            coroutine function callbacks)
+        """
+        return self.callback(**self.get_callback_kwargs(changes, diff,
+                                                        obj=obj))
+
+    def invoke_many(self, objs, changes=None, diff=None):
+        """
+        Call the registered batch callback function immediately. It is called
+        from the dispatch backend
+
+        Args:
+            objs (list): A list of object instances
+            changes (None, list): A list of `Change` records
+            diff (None, RelationDiff): A `RelationDiff` record
+
+        Returns:
+            The return value of the callback
         """
-        self.callback(sender=self, obj=obj, attr=self.attr)
+        return self.callback(**self.get_callback_kwargs(changes, diff,
+                                                        objs=objs))
 
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
     def get_field(self, attr=None):
         """
-        Get field instance of the attr in the target object
+        Get field instance of the attr in the target object. It is found from
+        the field index of the model
         """
         attr = attr or self.attr
         return get_field(self.model, attr)
@@ -1,12 +1,17 @@
-from django.db.models.signals import pre_save
-from django.db.models.signals import post_save
-from django.db.models.signals import m2m_changed
+import time
+import threading
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import ManyToManyField
 from django.contrib.contenttypes.generic import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
 from observer.conf import settings
-from observer.compat import lru_cache
-from observer.investigator import Investigator
-from observer.utils.signals import register_reciever, unregister_reciever
+from observer.compat import OrderedDict
+from observer.investigator import get_field_names
+from observer.investigator import RelationDiff
+from observer.dispatcher import get_dispatcher
+from observer.utils.models import iter_pk_chunks
+from observer.utils.models import resolve_generic_objects
+from observer.backends import ImmediateBackend
 from base import WatcherBase
 from value import ValueWatcher
 
@@ -17,7 +22,9 @@ class RelatedWatcherBase(WatcherBase):
     """
     def __init__(self, model, attr, callback,
                  call_on_created=True,
-                 include=None, exclude=None):
+                 include=None, exclude=None, pass_changes=False,
+                 backend=None, batch=False, chunk_size=None,
+                 pass_diff=False, pks_only=False, call_on_deleted=False):
         """
         Construct watcher field
 
@@ -31,60 +38,141 @@ class RelatedWatcherBase(WatcherBase):
                 which will be investigated to determine the modification
             exclude (None, list, tuple): A related object field name list
                 which won't be investigated to determine the modification
+            pass_changes (bool): Call the callback with `changes`
+            backend (None, str, backend): A dispatch backend
+            batch (bool): Call the callback once with `objs`, a list of the
+                affected object instances
+            chunk_size (None, int): Fetch the primary keys of the affected
+                object instances in chunks of the size and call the callback
+                per chunk. `OBSERVER_FANOUT_CHUNK_SIZE` is used if it is
+                not specified
+            pass_diff (bool): Call the callback with `diff`, a
+                `RelationDiff` record of the primary keys of the related
+                objects
+            pks_only (bool): Call the batch callback with `pks`, a list of
+                the primary keys of the affected object instances, without
+                loading the instances. It requires `batch`
+            call_on_deleted (bool): Call callback when the related objects
+                are deleted. The affected object instances which still exist
+                after the deletion are passed with the `removed` diff. Use
+                `ObserverModelMixin` (or `ObserverQuerySet.delete` and
+                `observer.dispatcher.collect_deleted`) to call the callback
+                once after the cascaded deletions
         """
-        super(RelatedWatcherBase, self).__init__(model, attr, callback)
+        if pks_only and not batch:
+            raise ValueError('pks_only requires batch')
+        super(RelatedWatcherBase, self).__init__(model, attr, callback,
+                                                 pass_changes=pass_changes,
+                                                 backend=backend,
+                                                 batch=batch,
+                                                 pass_diff=pass_diff)
         self.include = include
         self.exclude = exclude
         self._call_on_created = call_on_created
+        if chunk_size is None:
+            chunk_size = settings.OBSERVER_FANOUT_CHUNK_SIZE
+        self.chunk_size = chunk_size
+        self.pks_only = pks_only
+        self._call_on_deleted = call_on_deleted
+        self._stats_lock = threading.Lock()
+        self._stats = dict(chunks=0, objects=0, fetch_time=0.0,
+                           max_fetch_time=0.0)
+        self._relation = None
+
+    @property
+    def relation(self):
+        """
+        A dictionary of the resolved facts of the relation
+        """
+        if self._relation is None:
+            self.resolve_relation()
+        return self._relation
 
     @property
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
     def is_reversed(self):
-        return self.get_field().model != self._model
+        return self.relation['is_reversed']
 
     @property
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
     def related_model(self):
-        field = self.get_field()
-        if self.is_reversed:
-            return field.model
-        return field.related.parent_model
+        return self.relation['related_model']
 
     @property
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
     def related_attr(self):
+        return self.relation['related_attr']
+
+    def resolve_relation(self):
+        """
+        Resolve the facts of the relation and store them in the watcher. It
+        is called on watch thus the facts are not resolved on each save
+
+        Returns:
+            A dictionary of the resolved facts of the relation
+        """
         field = self.get_field()
-        if self.is_reversed:
+        is_reversed = self.resolve_is_reversed(field)
+        related_model = self.resolve_related_model(field, is_reversed)
+        self._relation = dict(
+            field=field,
+            is_reversed=is_reversed,
+            related_model=related_model,
+            related_attr=self.resolve_related_attr(field, is_reversed,
+                                                   related_model),
+        )
+        return self._relation
+
+    def resolve_is_reversed(self, field):
+        return field.model != self._model
+
+    def resolve_related_model(self, field, is_reversed):
+        if is_reversed:
+            return field.model
+        return field.rel.to
+
+    def resolve_related_attr(self, field, is_reversed, related_model):
+        if is_reversed:
             return field.name
         return field.related.get_accessor_name()
 
     def watch(self, call_on_created=None, include=None, exclude=None):
+        # the model (or the related model) might be resolved lazily thus
+        # resolve the relation again
+        self.resolve_relation()
         self._call_on_created = (self._call_on_created
                                  if call_on_created is None
                                  else call_on_created)
         include = include or self.include
         exclude = exclude or self.exclude
-        self._investigator = Investigator(self.related_model,
-                                          include=include,
-                                          exclude=exclude)
-        # register the receivers
-        register_reciever(self.model, pre_save,
-                          self._pre_save_receiver,
-                          sender=self.related_model)
-        register_reciever(self.model, post_save,
-                          self._post_save_receiver,
-                          sender=self.related_model)
-        register_reciever(self.model, post_save,
-                          self._post_save_receiver_for_creation)
+        field_names = None
+        if include or exclude:
+            field_names = get_field_names(self.related_model,
+                                          include, exclude)
+        # connect the receivers to the dispatchers
+        get_dispatcher(self.related_model).connect(
+            self._changed_receiver,
+            field_names=field_names,
+            require=self.get_required_field_names())
+        get_dispatcher(self.model).connect_created(
+            self._created_receiver, many=self._created_many_receiver)
+        if self._call_on_deleted:
+            get_dispatcher(self.related_model).connect_deleted(
+                self._deleted_receiver,
+                capture=self.get_deleted_pairs,
+                capture_many=self.get_deleted_pairs_many)
 
     def unwatch(self):
-        # unregister the receivers
-        unregister_reciever(self.model, pre_save,
-                            self._pre_save_receiver)
-        unregister_reciever(self.model, post_save,
-                            self._post_save_receiver)
-        unregister_reciever(self.model, post_save,
-                            self._post_save_receiver_for_creation)
+        get_dispatcher(self.related_model).disconnect(self._changed_receiver)
+        get_dispatcher(self.related_model).disconnect_deleted(
+            self._deleted_receiver)
+        get_dispatcher(self.model).disconnect_created(self._created_receiver)
+
+    def get_required_field_names(self):
+        """
+        Get field names of the related model which are required to find the
+        related objects from the snapshots
+        """
+        if self.is_reversed:
+            return [self.related_attr]
+        return []
 
     def get_value(self, instance):
         try:
@@ -92,6 +180,26 @@ class RelatedWatcherBase(WatcherBase):
         except ObjectDoesNotExist:
             return None
 
+    def get_values_pair(self, snapshot, instance):
+        """
+        Get sets of the related objects of the snapshot and the instance
+        """
+        return self.get_values(snapshot), self.get_values(instance)
+
+    def get_related_pks_pair(self, snapshot, instance):
+        """
+        Get sets of the primary keys of the related objects of the snapshot
+        and the instance from the raw column values (e.g. `article_id`)
+        without queries. It returns None when the relation is not a reverse
+        foreign key thus the primary keys are not on the instance
+        """
+        field = self.relation['field']
+        if not self.is_reversed or isinstance(field, ManyToManyField):
+            return None
+        return tuple(set([x]) if x is not None else set()
+                     for x in (getattr(obj, field.attname, None)
+                               for obj in (snapshot, instance)))
+
     def get_values(self, instance):
         value = self.get_value(instance)
         if value is None:
@@ -102,40 +210,203 @@ class RelatedWatcherBase(WatcherBase):
             value = tuple([value])
         return set(value)
 
-    def _pre_save_receiver(self, sender, instance, **kwargs):
-        if kwargs.get('row', False):
-            # should not call any callback while it is called via fixtures or
-            # so on
+    def get_reference(self, obj):
+        """
+        Get an object reference passed to the callback (a primary key if
+        `pks_only` is specified)
+        """
+        return obj.pk if self.pks_only else obj
+
+    def call_chunks(self, queryset, changes=None, diff=None):
+        """
+        Call the callback with the objects of the queryset chunk by chunk
+        """
+        if self.is_suspended():
             return
-        self._investigator.prepare(instance)
+        started_at = time.time()
+        for pks in iter_pk_chunks(queryset, self.chunk_size):
+            self._call_chunk(pks, changes, diff, started_at)
+            started_at = time.time()
 
-    def _post_save_receiver(self, sender, instance, **kwargs):
-        if kwargs.get('row', False):
-            # should not call any callback while it is called via fixtures or
-            # so on
+    def call_pks(self, pks, changes=None, diff=None):
+        """
+        Call the callback with the objects of the primary keys chunk by chunk
+        """
+        if self.is_suspended():
             return
-        # get a reverse related objects from the instance
-        instance_cached = self._investigator.get_cached(instance.pk)
-        values_cached = self.get_values(instance_cached)
-        values_latest = self.get_values(instance)
-        object_set = values_cached | values_latest
-        if any(self._investigator.investigate(instance)):
-            for obj in object_set:
-                self.call(obj)
-
-    def _post_save_receiver_for_creation(self, sender, instance,
-                                         created, **kwargs):
-        if kwargs.get('row', False):
-            # should not call any callback while it is called via fixtures or
-            # so on
+        pks = list(pks)
+        chunk_size = (self.chunk_size or
+                      settings.OBSERVER_IN_BULK_CHUNK_SIZE or len(pks))
+        for i in range(0, len(pks), chunk_size):
+            self._call_chunk(pks[i:i + chunk_size], changes, diff,
+                             time.time())
+
+    def _call_chunk(self, pks, changes, diff, started_at):
+        if self.pks_only:
+            objs = pks
+        else:
+            # in_bulk loads the objects with a query
+            in_bulk = self.model._default_manager.in_bulk(pks)
+            objs = [in_bulk[pk] for pk in pks if pk in in_bulk]
+        fetch_time = time.time() - started_at
+        with self._stats_lock:
+            self._stats['chunks'] += 1
+            self._stats['objects'] += len(objs)
+            self._stats['fetch_time'] += fetch_time
+            self._stats['max_fetch_time'] = max(
+                self._stats['max_fetch_time'], fetch_time)
+        self.call_many(objs, changes, diff)
+
+    def stats(self):
+        """
+        Return the statistics of the chunked fan-out
+
+        Returns:
+            A dictionary which contains the number of the chunks and the
+            objects and the average and maximum seconds to fetch a chunk
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        chunks = stats['chunks']
+        stats['fetch_time'] = stats['fetch_time'] / chunks if chunks else 0.0
+        return stats
+
+    def invoke_many(self, objs, changes=None, diff=None):
+        if not self.pks_only:
+            return super(RelatedWatcherBase, self).invoke_many(objs, changes,
+                                                               diff)
+        return self.callback(**self.get_callback_kwargs(changes, diff,
+                                                        pks=objs))
+
+    def get_deleted_pairs(self, instance):
+        """
+        Get (deleted pk, affected pk) pairs of the related object instance
+        which is going to be deleted
+
+        Args:
+            instance (obj): An instance of the related model
+
+        Returns:
+            list
+        """
+        field = self.relation['field']
+        if self.is_reversed and not isinstance(field, ManyToManyField):
+            # the primary key is on the instance thus no query is required
+            pk = getattr(instance, field.attname, None)
+            return [(instance.pk, pk)] if pk is not None else []
+        queryset = self.related_model._default_manager.filter(pk=instance.pk)
+        return self.get_deleted_pairs_many(queryset)
+
+    def get_deleted_pairs_many(self, queryset):
+        """
+        Get (deleted pk, affected pk) pairs of the related objects of the
+        queryset which are going to be deleted with a single query
+
+        Args:
+            queryset (queryset): A queryset of the related model
+
+        Returns:
+            list
+        """
+        field = self.relation['field']
+        if self.is_reversed:
+            pairs = queryset.values_list('pk', field.name)
+        else:
+            manager = self.model._default_manager
+            pairs = (manager.filter(**{'%s__in' % field.name: queryset})
+                            .values_list(field.name, 'pk'))
+        return [(x, y) for x, y in pairs if y is not None]
+
+    def _deleted_receiver(self, pairs):
+        # the deleted pks per affected pk
+        deleted = OrderedDict()
+        for deleted_pk, pk in pairs:
+            deleted.setdefault(pk, set()).add(deleted_pk)
+        if self.batch:
+            diff = RelationDiff.create(
+                removed=[x for pks in deleted.values() for x in pks])
+            self.call_pks(deleted.keys(), diff=diff)
+            return
+        # group the affected pks by the deleted pks to load them in bulk
+        groups = OrderedDict()
+        for pk, deleted_pks in deleted.items():
+            groups.setdefault(frozenset(deleted_pks), []).append(pk)
+        for deleted_pks, pks in groups.items():
+            self.call_pks(pks, diff=RelationDiff.create(removed=deleted_pks))
+
+    def get_related_manager(self, instance):
+        """
+        Get the related manager of the instance or None if the related value
+        is not a manager
+        """
+        value = self.get_value(instance)
+        if hasattr(value, 'values_list'):
+            return value
+        return None
+
+    def _changed_receiver(self, instance, changes, snapshot):
+        pks_pair = self.get_related_pks_pair(snapshot, instance)
+        value = None
+        if pks_pair is None:
+            value = self.get_related_manager(instance)
+        if value is not None:
+            # the related objects of the snapshot and the latest instance are
+            # the same for related managers thus query them once
+            diff = RelationDiff.create(unchanged=[instance.pk])
+            if self.chunk_size:
+                self.call_chunks(value.all(), changes, diff)
+            elif self.pks_only:
+                self.call_many(value.values_list('pk', flat=True),
+                               changes, diff)
+            else:
+                self.call_many(value.all(), changes, diff)
             return
-        if self._call_on_created and created:
-            self.call(instance)
+        # find the objects which the instance is added to or removed from
+        if pks_pair is None:
+            values_cached, values_latest = self.get_values_pair(snapshot,
+                                                                instance)
+            objects = dict((x.pk, x) for x in values_cached)
+            objects.update((x.pk, x) for x in values_latest)
+            pks_cached = frozenset(x.pk for x in values_cached)
+            pks_latest = frozenset(x.pk for x in values_latest)
+        else:
+            pks_cached, pks_latest = pks_pair
+            objects = None
+            if not self.pks_only and (pks_cached or pks_latest):
+                # the objects are loaded at once only when they are passed
+                manager = self.model._default_manager
+                objects = manager.in_bulk(list(pks_cached | pks_latest))
+        groups = (
+            (pks_latest - pks_cached, 'added'),
+            (pks_cached - pks_latest, 'removed'),
+            (pks_latest & pks_cached, 'unchanged'),
+        )
+        for pks, key in groups:
+            if not pks:
+                continue
+            if objects is None:
+                references = list(pks)
+            else:
+                references = [self.get_reference(objects[pk])
+                              for pk in pks if pk in objects]
+            diff = RelationDiff.create(**{key: [instance.pk]})
+            self.call_many(references, changes, diff)
+
+    def _created_receiver(self, instance):
+        if self._call_on_created:
+            self.call(self.get_reference(instance))
+
+    def _created_many_receiver(self, instances):
+        if self._call_on_created:
+            self.call_many([self.get_reference(x) for x in instances])
 
 
 class RelatedWatcher(RelatedWatcherBase):
     def __init__(self, model, attr, callback,
-                 call_on_created=True, include=None, exclude=None):
+                 call_on_created=True, include=None, exclude=None,
+                 pass_changes=False, backend=None, batch=False,
+                 chunk_size=None, pass_diff=False, pks_only=False,
+                 call_on_deleted=False):
         """
         Construct watcher field
 
@@ -149,15 +420,40 @@ class RelatedWatcher(RelatedWatcherBase):
                 which will be investigated to determine the modification
             exclude (None, list, tuple): A related object field name list
                 which won't be investigated to determine the modification
+            pass_changes (bool): Call the callback with `changes`
+            backend (None, str, backend): A dispatch backend
+            batch (bool): Call the callback once with `objs`, a list of the
+                affected object instances
+            chunk_size (None, int): Fetch the affected object instances in
+                chunks of the size
+            pass_diff (bool): Call the callback with `diff`, a
+                `RelationDiff` record of the primary keys of the related
+                objects
+            pks_only (bool): Call the batch callback with `pks` instead of
+                `objs`
+            call_on_deleted (bool): Call callback when the related objects
+                are deleted
         """
         # add internal valuefiled
         super(RelatedWatcher, self).__init__(model, attr, callback,
-                                             include, exclude)
+                                             include=include,
+                                             exclude=exclude,
+                                             pass_changes=pass_changes,
+                                             backend=backend,
+                                             batch=batch,
+                                             chunk_size=chunk_size,
+                                             pass_diff=pass_diff,
+                                             pks_only=pks_only,
+                                             call_on_deleted=call_on_deleted)
         self._call_on_created = call_on_created
-        inner_callback = lambda sender, obj, attr: self.call(obj)
+        # the inner watcher calls the callback through the backend of this
+        # watcher thus it should not defer the call by itself
         self._inner_watcher = ValueWatcher(self.model,
                                            self.attr,
-                                           inner_callback)
+                                           self._inner_callback,
+                                           pass_changes=True,
+                                           backend=ImmediateBackend())
+        self._inner_watcher.owner = self
 
     def watch(self, call_on_created=None,
               include=None, exclude=None):
@@ -174,12 +470,31 @@ class RelatedWatcher(RelatedWatcherBase):
         super(RelatedWatcher, self).unwatch()
         self._inner_watcher.unwatch()
 
+    def _inner_callback(self, sender, obj, attr, changes):
+        diff = None
+        for change in changes or ():
+            if change.field == self.attr:
+                diff = RelationDiff.from_pks(
+                    [x for x in (change.old,) if x is not None],
+                    [x for x in (change.new,) if x is not None])
+        self.call(self.get_reference(obj), changes, diff)
+
 
 class ManyRelatedWatcher(RelatedWatcherBase):
+    def __init__(self, *args, **kwargs):
+        super(ManyRelatedWatcher, self).__init__(*args, **kwargs)
+        # (through model, instance class, instance pk) -> cleared pks
+        self._cleared = {}
+
     @property
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
     def through_model(self):
-        return getattr(self.get_field().rel, 'through', None)
+        return self.relation['through_model']
+
+    def resolve_relation(self):
+        relation = super(ManyRelatedWatcher, self).resolve_relation()
+        relation['through_model'] = getattr(relation['field'].rel,
+                                            'through', None)
+        return relation
 
     def watch(self, call_on_created=None):
         if call_on_created is not None:
@@ -187,73 +502,203 @@ class ManyRelatedWatcher(RelatedWatcherBase):
         super(ManyRelatedWatcher, self).watch(call_on_created)
         if self.through_model:
             # m2m relation
-            register_reciever(self.model, m2m_changed,
-                              self._m2m_changed_receiver,
-                              sender=self.through_model)
+            get_dispatcher(self.through_model).connect_m2m(
+                self._m2m_changed_receiver)
 
     def unwatch(self):
         super(ManyRelatedWatcher, self).unwatch()
         if self.through_model:
-            unregister_reciever(self.model, m2m_changed,
-                                self._m2m_changed_receiver)
+            get_dispatcher(self.through_model).disconnect_m2m(
+                self._m2m_changed_receiver)
+
+    def get_related_pks(self, instance, reverse):
+        """
+        Get a list of the primary keys of the objects related to the instance
+        from the through table with a single query
+
+        Args:
+            instance (obj): An instance of either side of the relation
+            reverse (bool): True if the instance is an instance of the model
+                which does not have the ManyToManyField
+
+        Returns:
+            list
+        """
+        field = self.relation['field']
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+        if reverse:
+            source, target = target, source
+        manager = self.through_model._default_manager
+        return list(manager.filter(**{source: instance.pk})
+                           .values_list(target, flat=True))
+
+    def get_deleted_pairs_many(self, queryset):
+        if not self.through_model:
+            return super(ManyRelatedWatcher, self).get_deleted_pairs_many(
+                queryset)
+        # query the through table to get the pairs of the deleted objects
+        field = self.relation['field']
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+        if not self.is_reversed:
+            source, target = target, source
+        manager = self.through_model._default_manager
+        return list(manager.filter(**{'%s__in' % source: queryset})
+                           .values_list(source, target))
 
     def _m2m_changed_receiver(self, sender, instance, action,
                               reverse, model, pk_set, **kwargs):
-        if kwargs.get('row', False):
+        if kwargs.get('raw', False) or self.is_suspended():
             # should not call any callback while it is called via fixtures or
             # so on
             return
-        if action not in ('post_add', 'post_remove', 'post_clear'):
+        key = (sender, instance.__class__, instance.pk)
+        if action == 'pre_clear':
+            # pk_set is None for clear thus capture the pks to be cleared
+            # (it is not required when the pks are not passed)
+            if instance.__class__ != self.model or self._pass_diff:
+                self._cleared[key] = self.get_related_pks(instance, reverse)
+            return
+        if action == 'post_clear':
+            pk_set = self._cleared.pop(key, None)
+        elif action not in ('post_add', 'post_remove'):
             return
+        name = 'added' if action == 'post_add' else 'removed'
         if instance.__class__ == self.model:
-            self.call(instance)
-        else:
-            # TODO: pk_set is None for post_clear thus cache the pk_set
-            #       with 'pre_clear' and use the cache to tell.
-            manager = self.model._default_manager
-            for obj in manager.filter(pk__in=pk_set):
-                self.call(obj)
+            diff = None
+            if pk_set is not None:
+                diff = RelationDiff.create(**{name: pk_set})
+            self.call(self.get_reference(instance), diff=diff)
+        elif pk_set:
+            diff = RelationDiff.create(**{name: [instance.pk]})
+            self.call_pks(pk_set, diff=diff)
 
 
 class GenericRelatedWatcher(RelatedWatcher):
-    @property
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
-    def is_reversed(self):
-        return isinstance(self.get_field(), GenericForeignKey)
+    def resolve_is_reversed(self, field):
+        return isinstance(field, GenericForeignKey)
 
-    @property
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
-    def related_model(self):
-        field = self.get_field()
-        if self.is_reversed:
+    def resolve_related_model(self, field, is_reversed):
+        if is_reversed:
             return field.model
         return field.rel.to
 
-    @property
-    @lru_cache(settings.OBSERVER_LRU_CACHE_SIZE)
-    def related_attr(self):
-        field = self.get_field()
-        if self.is_reversed:
-            return field.name
+    def resolve_related_attr(self, field, is_reversed, related_model):
+        return self.resolve_generic_foreign_key(
+            field, is_reversed, related_model).name
+
+    def resolve_generic_foreign_key(self, field, is_reversed, related_model):
+        if is_reversed:
+            return field
         # find GenericForeignKey field
-        for related_field in self.related_model._meta.virtual_fields:
+        for related_field in related_model._meta.virtual_fields:
             if isinstance(related_field, GenericForeignKey):
-                return related_field.name
+                return related_field
         raise KeyError
 
+    def resolve_relation(self):
+        relation = super(GenericRelatedWatcher, self).resolve_relation()
+        relation['generic_foreign_key'] = self.resolve_generic_foreign_key(
+            relation['field'], relation['is_reversed'],
+            relation['related_model'])
+        return relation
+
+    def get_required_field_names(self):
+        field = self.get_field()
+        if self.is_reversed:
+            return [field.ct_field, field.fk_field]
+        return [field.content_type_field_name, field.object_id_field_name]
+
+    def get_generic_reference(self, instance):
+        """
+        Get a (content type id, object id) pair of the instance without
+        queries
+        """
+        field = self.relation['field']
+        ct_field = instance._meta.get_field(field.content_type_field_name)
+        return (getattr(instance, ct_field.attname, None),
+                getattr(instance, field.object_id_field_name, None))
+
+    def get_deleted_pairs(self, instance):
+        if self.is_reversed:
+            # the related objects of GenericForeignKey are not determined
+            return []
+        ct, object_id = self.get_generic_reference(instance)
+        if ct != ContentType.objects.get_for_model(self.model).pk or \
+                object_id is None:
+            return []
+        return [(instance.pk, self.model._meta.pk.to_python(object_id))]
+
+    def get_deleted_pairs_many(self, queryset):
+        if self.is_reversed:
+            return []
+        field = self.relation['field']
+        ct = ContentType.objects.get_for_model(self.model)
+        pairs = (queryset.filter(**{field.content_type_field_name: ct})
+                         .values_list('pk', field.object_id_field_name))
+        to_python = self.model._meta.pk.to_python
+        return [(x, to_python(y)) for x, y in pairs if y is not None]
+
+    def get_loaded_value(self, instance, reference):
+        """
+        Get the object of the GenericForeignKey of the instance if it is
+        already loaded (cached) and it is the object of the reference
+        """
+        gfk = self.relation['generic_foreign_key']
+        cache_attr = getattr(gfk, 'cache_attr', '_%s_cache' % gfk.name)
+        obj = getattr(instance, cache_attr, None)
+        if obj is None or obj.pk != reference[1]:
+            return None
+        ct = ContentType.objects.get_for_model(obj)
+        if ct.pk != reference[0]:
+            return None
+        return obj
+
+    def get_related_manager(self, instance):
+        if self.is_reversed:
+            return super(GenericRelatedWatcher, self).get_related_manager(
+                instance)
+        # the related value of GenericRelation is a single object
+        return None
+
+    def get_related_pks_pair(self, snapshot, instance):
+        # the related objects of GenericForeignKey are not determined
+        # from a single column
+        return None
+
+    def get_values_pair(self, snapshot, instance):
+        if self.is_reversed:
+            return super(GenericRelatedWatcher, self).get_values_pair(
+                snapshot, instance)
+        # use the loaded objects and resolve the others at once
+        values = [None, None]
+        references = {}
+        for i, obj in enumerate((snapshot, instance)):
+            if obj is None:
+                continue
+            reference = self.get_generic_reference(obj)
+            values[i] = self.get_loaded_value(obj, reference)
+            if values[i] is None:
+                references[i] = reference
+        if references:
+            resolved = resolve_generic_objects(references.values())
+            for i, reference in references.items():
+                values[i] = resolved.get(reference)
+        return tuple(set([x]) if x is not None else set() for x in values)
+
     def get_value(self, instance):
         try:
             if self.is_reversed:
-                field = self.get_field()
                 return super(GenericRelatedWatcher, self).get_value(instance)
             else:
                 if instance is None:
                     return None
-                field = self.get_field()
-                ct = getattr(instance, field.content_type_field_name)
-                pk = getattr(instance, field.object_id_field_name)
-                if ct is None:
-                    return None
-                return ct.get_object_for_this_type(pk=pk)
+                reference = self.get_generic_reference(instance)
+                value = self.get_loaded_value(instance, reference)
+                if value is None:
+                    value = resolve_generic_objects([reference]).get(
+                        reference)
+                return value
         except ObjectDoesNotExist:
             return None
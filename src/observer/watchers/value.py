@@ -1,8 +1,4 @@
-from django.db.models.signals import pre_save
-from django.db.models.signals import post_save
-from observer.investigator import Investigator
-from observer.utils.signals import (register_reciever,
-                                    unregister_reciever)
+from observer.dispatcher import get_dispatcher
 from base import WatcherBase
 
 
@@ -10,42 +6,47 @@ class ValueWatcher(WatcherBase):
     """
     Watcher field for watching non relational field such as CharField.
     """
-    def __init__(self, model, attr, callback, call_on_created=True):
-        super(ValueWatcher, self).__init__(model, attr, callback)
+    def __init__(self, model, attr, callback, call_on_created=True,
+                 pass_changes=False, backend=None, batch=False):
+        super(ValueWatcher, self).__init__(model, attr, callback,
+                                           pass_changes=pass_changes,
+                                           backend=backend,
+                                           batch=batch)
         self._call_on_created = call_on_created
 
     def watch(self, call_on_created=None):
         self._call_on_created = (self._call_on_created
                                  if call_on_created is None
                                  else call_on_created)
-        # initialize investigator
-        self._investigator = Investigator(self.model, include=[self.attr])
-        # register the receivers
-        register_reciever(self.model, pre_save,
-                          self._pre_save_receiver)
-        register_reciever(self.model, post_save,
-                          self._post_save_receiver)
+        # connect the receivers to the dispatcher of the model
+        dispatcher = get_dispatcher(self.model)
+        dispatcher.connect(self._changed_receiver,
+                           field_names=[self.attr],
+                           many=self._changed_many_receiver)
+        dispatcher.connect_created(self._created_receiver,
+                                   many=self._created_many_receiver)
 
     def unwatch(self):
-        unregister_reciever(self.model, pre_save,
-                            self._pre_save_receiver)
-        unregister_reciever(self.model, post_save,
-                            self._post_save_receiver)
-
-    def _pre_save_receiver(self, sender, instance, **kwargs):
-        if kwargs.get('row', False):
-            # should not call any callback while it is called via fixtures or
-            # so on
-            return
-        self._investigator.prepare(instance)
+        dispatcher = get_dispatcher(self.model)
+        dispatcher.disconnect(self._changed_receiver)
+        dispatcher.disconnect_created(self._created_receiver)
 
-    def _post_save_receiver(self, sender, instance, created, **kwargs):
-        if kwargs.get('row', False):
-            # should not call any callback while it is called via fixtures or
-            # so on
-            return
-        if self._call_on_created and created:
-            self.call(instance)
-        # if investigator yield any field_name, call the callback
-        if any(self._investigator.investigate(instance)):
+    def _created_receiver(self, instance):
+        if self._call_on_created:
             self.call(instance)
+
+    def _created_many_receiver(self, instances):
+        if self._call_on_created:
+            self.call_many(instances)
+
+    def _changed_receiver(self, instance, changes, snapshot):
+        self.call(instance, changes)
+
+    def _changed_many_receiver(self, entries):
+        if not self.batch:
+            for instance, changes, snapshot in entries:
+                self.call(instance, changes)
+            return
+        # the changes differ among the instances thus it is unknown
+        changes = entries[0][1] if len(entries) == 1 else None
+        self.call_many([x[0] for x in entries], changes)